@@ -1,243 +1,148 @@
 import streamlit as st
 import pandas as pd
-import time
 import numpy as np
+import plotly
 import visualisations
-import asyncio
-import os
+import data_prep
+import render_cache
+import disk_cache
+import assets
+import animations
+import settings
+import timing
+import payloads
+import data_store
+import peers
+import functools
 import base64
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-async def animate_gauge_async(chart_placeholder, fig, region, frames, bounds):
-    value = fig.data[0].value
-    steps = np.linspace(bounds[0], value, num=frames)
-    for i, v in enumerate(steps):
-        if np.isnan(value):
-            await asyncio.sleep(0.01 + 0.08 * (i / len(steps))**4)
-            continue
-        fig.data[0].value = v
-        if v * 1.15 > bounds[1]:
-            fig.data[0].gauge.axis.range = [bounds[0], v * 1.15]
-        chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'gauge-{region}-{v}')
-        await asyncio.sleep(0.01 + 0.08 * (i / len(steps))**4)
-    fig.data[0].value = round(value, 3)
-    chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'gauge-{region}-final')
-
-async def animate_time_series_async(chart_placeholder, fig, data, selected_indicator, regions, frames):
-    traces = []
-    data = data.dropna()
-    for region in regions:
-        temp = data.loc[data['name'] == region, :].sort_values(by='year')
-        years = temp['year'].tolist()
-        values = temp[selected_indicator].tolist()
-        traces.append({'region': region, 'years': years, 'values': values, 'animated_years': [], 'animated_values': []})
-    
-    max_steps = max(len(trace['years']) - 1 for trace in traces)
-    for i in range(len(traces[0]['years']) - 1):
-        # Interpolate for all traces in parallel
-        interp_steps = []
-        for trace in traces:
-            if i >= len(trace['years']) - 1:
-                interp_steps.append(([], []))  # Add empty interpolation for this trace
-                continue
-            
-            if np.isnan(trace['years'][i]) or np.isnan(trace['years'][i + 1]) or \
-               np.isnan(trace['values'][i]) or np.isnan(trace['values'][i + 1]):
-                continue
-            interp_years = np.linspace(trace['years'][i], trace['years'][i + 1], int(frames / len(traces[0]['years'])))
-            interp_values = np.linspace(trace['values'][i], trace['values'][i + 1], int(frames / len(traces[0]['years'])))
-            interp_steps.append((interp_years, interp_values))
-
-        for j in range(len(interp_steps[0][0])):
-            for idx, trace in enumerate(traces):
-                if len(interp_steps[idx][0]) > 0:  # Only update if interpolation exists
-                    trace['animated_years'] = trace['years'][:i + 1] + [interp_steps[idx][0][j]]
-                    trace['animated_values'] = trace['values'][:i + 1] + [interp_steps[idx][1][j]]
-                    fig.data[idx].x = trace['animated_years']
-                    fig.data[idx].y = trace['animated_values']
-            chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'time_series-{i}-{j}')
-            await asyncio.sleep(0.02 + 0.1 * (j / len(interp_steps[0][0]))**4)
-
-
-    for trace in traces:
-        trace['animated_years'].append(trace['years'][-1])
-        trace['animated_values'].append(trace['values'][-1])
-    for idx, trace in enumerate(traces):
-        fig.data[idx].x = trace['animated_years']
-        fig.data[idx].y = trace['animated_values']
-    chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'time_series-final')
-
-async def animate_spider_async(chart_placeholder, fig, region, frames):
-    # Extract the initial radial values (r) from the figure
-    initial_r = np.full(len(fig.data[0].r), 20)  # Start with 59 for all indicators
-    final_r = np.array(fig.data[0].r)  # Final values from the spider plot
-
-    # Interpolate the radial values for each frame
-    steps = np.linspace(0, 1, frames)  # Create interpolation steps
-    for step in steps:
-        # Interpolate between initial and final values
-        current_r = initial_r + step * (final_r - initial_r)
-        
-        # Update the figure with the interpolated values
-        fig.data[0].r = current_r
-        chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'spider-{region}-{step}')
-        
-        # Add a small delay for animation
-        await asyncio.sleep(0.03 + 0.3 * (step / len(steps))**4)
+# Most regions compared at once in the time series and bar charts
+MAX_REGIONS = 20
 
-    # Finalize the animation with the full radial values
-    fig.data[0].r = final_r
-    chart_placeholder.plotly_chart(fig, use_container_width=True, key=f'spider-{region}-final')
+# Most similar regions listed under each spider plot
+PEERS = 5
 
-@st.cache_data(show_spinner=False)
-def load_data():
-    return pd.read_csv('src/itl3_compare_data.csv'), pd.read_csv('src/itl3_compare_uk_data.csv')
+def show_chart(placeholder, fig, key, animate=None):
+    # Animations are computed up front and played back in the browser from a single payload
+    if settings.ANIMATE and animate is not None:
+        with timing.span('animations'):
+            frames, durations = animate(fig)
+            chart_html, height = animations.html(fig, frames, durations, settings.SELF_HOSTED_ASSETS)
+        with placeholder:
+            st.components.v1.html(chart_html, height=height)
+    else:
+        placeholder.plotly_chart(fig, use_container_width=True, key=key)
 
-async def main():
-    st.set_page_config(layout="wide", page_title="ITL3 Compare")
+def timing_enabled():
+    # Opt in for every session with ITL3_TIMING, or for one session with ?debug=timing
+    return settings.TIMING or st.query_params.get('debug', '').lower() == 'timing'
 
-    def img_to_base64(path):
-        with open(path, "rb") as f:
-            return base64.b64encode(f.read()).decode()
+def recorded(func):
+    # Times a full run or a fragment rerun; inside a full run a fragment's spans join the outer record
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        ctx = get_script_run_ctx()
+        with timing.rerun(timing_enabled(), run=func.__name__, session=ctx.session_id if ctx else None) as record:
+            result = func(*args, **kwargs)
+        if record is not None and record['enabled']:
+            st.session_state['timing'] = record
+        return result
+    return wrapper
 
-    logo_base64 = img_to_base64("static/logo.png")
-    figshare_base64 = img_to_base64("static/Figshare_logo.png")
-    cc_base64 = img_to_base64("static/cc.xlarge.png")
+@st.fragment(run_every=2)
+def timing_panel():
+    # Refreshes by itself, so it also picks up reruns of the fragments
+    record = st.session_state.get('timing')
+    st.subheader("Rerun timings")
+    if record is None:
+        st.caption("No rerun recorded yet.")
+        return
+    st.caption(f"Last {record['run']} run: {record['total_ms']:.1f} ms")
+    st.dataframe(
+        pd.DataFrame([{'span': '\u2003' * span['depth'] + span['name'], 'ms': span['ms']} for span in record['spans']]),
+        hide_index=True, use_container_width=True
+    )
+    st.caption("Rolling aggregates for this process")
+    st.dataframe(pd.DataFrame(timing.aggregates()).T, use_container_width=True)
+    worker = st.session_state.get('warmup')
+    if worker is not None:
+        progress = worker.progress()
+        st.caption(f"Cache warm-up {progress['state']}: {progress['done']} of {progress['total']} built, {progress['skipped']} skipped")
+        st.dataframe(pd.DataFrame(progress['caches']).T, use_container_width=True)
 
-    st.markdown(f"""
-    <div style="
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-        width: 200w;
-        margin: -45px -80px 10px -80px;
-        background-color: #ffffff;
-        padding: 10px 50px;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.12);
-        position: relative;
-    ">
-        <a href='https://lab.productivity.ac.uk/' target='_blank'>
-            <img src='data:image/png;base64,{logo_base64}' style='height:30px;'>
-        </a>
-        <a href='https://doi.org/10.48420/30030220' target='_blank'>
-            <img src='data:image/png;base64,{figshare_base64}' style='height:50px;'>
-        </a>
-    </div>
-    """, unsafe_allow_html=True)
+# Writes to a shared frame copy it first instead of changing it for every session
+pd.set_option('mode.copy_on_write', True)
 
-    # Initialise data
-    all_data, uk_data = load_data()
+@st.cache_resource(show_spinner=False)
+def data_partitions():
+    # One dataset per geography level and process, shared by every session, loaded on first use and
+    # reloaded in the background when its CSV changes
+    partitions = data_store.Partitions(poll_seconds=settings.DATA_POLL_SECONDS, idle_seconds=settings.PARTITION_IDLE_SECONDS,
+                                       disk=shared_disk_cache())
+    # Entries built from a replaced or dropped dataset can never be hit again
+    for cache in (bar_html_cache(), figure_cache()):
+        partitions.on_swap(lambda old, new, cache=cache: cache.evict(lambda key: key[0] == old))
+    return partitions
 
-    all_data['GVA/H volume'] = all_data.groupby("code")["GVA/H volume"].transform(
-        lambda x: (x / x.loc[all_data.loc[x.index, "year"] == 2008].values[0]) * 100
-    )
-    uk_data['GVA/H volume'] = uk_data.groupby("code")["GVA/H volume"].transform(
-        lambda x: (x / x.loc[uk_data.loc[x.index, "year"] == 2008].values[0]) * 100
-    )
+def current_dataset(level):
+    with timing.span('data'):
+        dataset = data_partitions().get(level).current()
+    st.session_state['warmup'] = start_warmup(dataset['version'], level, dataset)
+    return dataset
 
-    driver = {
-        'GVA per hour worked': ['Productivity measured as Gross Value Added per hour worked', '2023', '2004', '<a href="https://www.ons.gov.uk/employmentandlabourmarket/peopleinwork/labourproductivity/datasets/subregionalproductivitylabourproductivitygvaperhourworkedandgvaperfilledjobindicesbyuknuts2andnuts3subregions" target="_blank">Source</a>'],
-        'Export Intensity': ['Exports as a percentage of GDP ', '2023', '2016', '<a href="https://www.ons.gov.uk/businessindustryandtrade/internationaltrade/datasets/subnationaltradeingoods" target="_blank">Source</a>'],
-        'New Businesses': ['New firms as a percentage of total active firms', '2023', '2017', '<a href="https://www.ons.gov.uk/businessindustryandtrade/business/activitysizeandlocation/datasets/businessdemographyreferencetable" target="_blank">Source</a>'],
-        'Low Skilled': ["Percentage of the working-age population with NVQ1/RQF1 or ‘no qualifications’", '2024', '2016', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
-        'High Skilled': ["Percentage of the working-age population with qualification at NVQ4+/RQF4+ level", '2024', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
-        'Active': ['Percentage of the working-age population active in employment', '2024', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
-        'Inactive due to Illness': ['Percentage of <i>inactive</i> working age population, inactive due to ill health', '2024', '2014', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
-        'Working Age': ['Percentage of the total population that are of working age (aged 16-64)', '2023', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
-        '5G connectivity': ['Percentage of outdoor areas with 5G service access from at least one mobile network operator', '2025', '2023', '<a href="https://www.ofcom.org.uk/research-and-data/multi-sector-research/infrastructure-research" target="_blank">Source</a>'],
-        'Gigabit connectivity': ['Percentage of premises that have access to a gigabit connection', '2025', '2021', '<a href="https://www.ofcom.org.uk/research-and-data/multi-sector-research/infrastructure-research" target="_blank">Source</a>'],
-        'GFCF per job': ['Gross fixed capital formation per job, total amount of investment in tangible and intangible assets', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>'],
-        'ICT per job': ['Total amount of investment in ICT equipment per job', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>'],
-        'Intangibles per job': ['Total amount of investment in intangible capital per job', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>']
-    }
-    # Filter indicator
-    indicators = driver.keys()
+@st.cache_resource(show_spinner=False)
+def shared_disk_cache():
+    # Shared with the other worker processes under serve.py; None when ITL3_DISK_CACHE_DIR isn't set. Keys
+    # carry the code that built each entry, so a deploy never reads back entries from the previous one
+    if not settings.DISK_CACHE_DIR:
+        return None
+    namespace = disk_cache.code_version(data_prep, peers, payloads, visualisations, pd, plotly, np)
+    try:
+        return disk_cache.DiskCache(settings.DISK_CACHE_DIR, settings.DISK_CACHE_BYTES, namespace)
+    except PermissionError as e:
+        timing.log_event(disk_cache.logger, 'disk_cache', state='not_used', error=str(e))
+        return None
 
-    st.markdown("""
-    <style>
-    /* Target each column container */
-    div[data-testid="stVerticalBlock"] > div[data-testid="stHorizontalBlock"] > div {
-        border: 1px solid #e0e0e0;
-        border-radius: 12px;
-        padding: 18px;
-        margin: 2px;
-        background-color: #ffffff;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.12);
-    }
-    /* Change main background color */
-    .stApp {
-        background-color: #6b739c;
-        min-width: 1500px; /* app won't shrink smaller than this */
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    cols = st.columns([1,2,1])
+@st.cache_resource(show_spinner=False)
+def bar_html_cache():
+    # Carousel HTML is the costliest payload to build, so it is also shared through the disk cache. Figures
+    # are not: they build about as fast as they could be read back
+    return render_cache.LRUCache(settings.BAR_HTML_CACHE_BYTES, backing=shared_disk_cache())
 
-    selected_indicator = 'GVA per hour worked'
-    data = all_data[['name', 'year', selected_indicator]]
-    
-    # Filter region
-    all_data = all_data.sort_values(by=['name', 'year'])
-    code = list(all_data['code'].unique())
-    itl3 = list(all_data['name'].unique())
-    query_params = {k.lower(): v.upper() for k, v in st.query_params.items()}
-    index_1 = 0
-    
-    if 'region_1' in query_params:
-        if query_params['region_1'] in code:
-            index_1 = code.index(query_params['region_1'])
-    with cols[0]:
-        selected_itl3_1 = st.selectbox("Select First ITL3 Region:", itl3, index=index_1)
-
-    index_2 = 1
-    if 'region_2' in query_params:
-            if query_params['region_2'] in code:
-                index_2 = code.index(query_params['region_2'])
-    with cols[2]:
-        selected_itl3_2 = st.selectbox("Select Second ITL3 Region:", itl3, index=index_2)
-
-    all_data = all_data.drop(columns='code')
-        
-    #tasks = []
-    # Create placeholders for the charts
-    gauge_1_placeholder = cols[0].empty()
-    time_series_placeholder = cols[1].empty()
-    gauge_2_placeholder = cols[2].empty()
-    spider_1_placeholder = cols[0].empty()
-    spider_2_placeholder = cols[2].empty()
-    # Calculate bounds as 2 standard deviations from the median (general bounds formula)
-    median = data.loc[data['year'] == int(driver[selected_indicator][1]), selected_indicator].median()
-    bounds = [median * 0.75, median * 1.25]
-    # Ensure indicators are not below 0 and encompass each class
-    bounds[0] = min(median * 0.85, max(0, bounds[0]))
-    bounds[1] = max(median * 1.15, bounds[1])
+@st.cache_resource(show_spinner=False)
+def figure_cache():
+    # One entry per figure: a region's gauge or spider, or the time series for a set of regions
+    return render_cache.LRUCache(settings.FIGURE_CACHE_ENTRIES, sizeof=lambda figure: 1)
 
-    
-    # Create a charts
-    gauge_1 = visualisations.gauge(data, selected_itl3_1, selected_indicator, driver[selected_indicator][1], bounds)
-    time_series = visualisations.time_series(all_data, [selected_itl3_1, selected_itl3_2], uk_data)
-    gauge_2 = visualisations.gauge(data, selected_itl3_2, selected_indicator, driver[selected_indicator][1], bounds)
-    spider_1 = visualisations.spider(all_data, indicators, selected_itl3_1, '#eb5e5e', driver)
-    spider_2 = visualisations.spider(all_data, indicators, selected_itl3_2, '#9c4f8b', driver)
-    
-    # Animate charts
-    # tasks.append(animate_gauge_async(gauge_1_placeholder, gauge_1, selected_itl3_1, 80, bounds))
-    # tasks.append(animate_time_series_async(time_series_placeholder, time_series, data, selected_indicator, [selected_itl3_1, selected_itl3_2], 80))
-    # tasks.append(animate_gauge_async(gauge_2_placeholder, gauge_2, selected_itl3_2, 80, bounds))
-    # tasks.append(animate_spider_async(spider_1_placeholder, spider_1, selected_itl3_1, 80))
-    # tasks.append(animate_spider_async(spider_2_placeholder, spider_2, selected_itl3_2, 80))
-    gauge_1_placeholder.plotly_chart(gauge_1, use_container_width=True, key=f'gauge-{selected_itl3_1}-1-final')
-    spider_1_placeholder.plotly_chart(spider_1, use_container_width=True, key=f'spider-{selected_itl3_1}-1-final')
-    
-    gauge_2_placeholder.plotly_chart(gauge_2, use_container_width=True, key=f'gauge-{selected_itl3_2}-2-final')
-    spider_2_placeholder.plotly_chart(spider_2, use_container_width=True, key=f'spider-{selected_itl3_2}-2-final')
+@st.cache_resource(show_spinner=False, max_entries=8)
+def start_warmup(version, level, _dataset):
+    # Once per process and dataset version; returns None when warming is off
+    if not settings.WARMUP:
+        return None
+    # Imported only when used, keeping it off a new server's first page load
+    import warmup
+    caches = {'figures': figure_cache(), 'bars': bar_html_cache()}
+    partitions = data_partitions()
+    return warmup.Warmup(_dataset, caches, warmup.parse_pairs(settings.WARMUP_PAIRS), workers=settings.WARMUP_WORKERS,
+                         stale=lambda: partitions.version(level) != version,
+                         data_paths=(partitions.levels[level], partitions.uk_data_path)).start()
 
-    time_series_placeholder.plotly_chart(time_series, use_container_width=True, key=f'time-series-final')
-    
+def cached(dataset, cache, task):
+    return cache.get_or_create(payloads.key(dataset['version'], task), lambda: payloads.build(dataset, task))
+
+def region_charts(dataset, region, indicator, colour):
+    # Cached per region, so changing the other region reuses this side's figures, and the spider is
+    # cached apart from the gauge as it doesn't change with the headline indicator
+    gauge = cached(dataset, figure_cache(), ('gauge', region, indicator))
+    spider = cached(dataset, figure_cache(), ('spider', region, colour))
+    return gauge, spider
+
+def eager_carousel(dataset, indicators, regions):
     carousel_items = ""
     # Convert Plotly bar charts to HTML
-    for i, indicator in enumerate(list(indicators)[1:]):
-        bar = visualisations.bar(all_data, indicator, [selected_itl3_1, selected_itl3_2], driver[indicator][0])
-        bar = bar.to_html(full_html=False, include_plotlyjs='cdn')
+    for i, indicator in enumerate(indicators):
+        bar = cached(dataset, bar_html_cache(), ('bar_html', indicator, *regions))
         # Set the first item as active
         active_class = "active" if i == 0 else ""
         carousel_items += f"""
@@ -246,8 +151,9 @@ async def main():
         </div>
         """
         
-    # HTML for the carousel
+    # HTML for the carousel, loading Plotly once for every slide
     carousel_html = f"""
+    {assets.plotly_html(settings.SELF_HOSTED_ASSETS)}
     <div id="carouselExample" class="carousel slide" data-bs-ride="carousel">
     <div class="carousel-inner">
         {carousel_items}  <!-- Python variable -->
@@ -262,8 +168,7 @@ async def main():
     </button>
     </div>
 
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js"></script>
+    {assets.bootstrap_html(settings.SELF_HOSTED_ASSETS)}
 
     <style>
     /* Shrink the actual buttons */
@@ -285,12 +190,157 @@ async def main():
     }}
     </style>
     """
-    with cols[1]:
-        # Display the carousel in Streamlit
-        st.components.v1.html(carousel_html, height=500)
+    # Display the carousel in Streamlit
+    st.components.v1.html(carousel_html, height=500)
+
+def region_select(label, dataset, level, query_params, param, default):
+    # Starts from the region_1/region_2 query parameter, then is kept in session state under its own key,
+    # so a peer click can set it whatever was picked by hand since
+    key = f'{param}-{level}'
+    if st.session_state.get(key) not in dataset['names']:
+        requested = query_params.get(param)
+        index = dataset['codes'].index(requested) if requested in dataset['codes'] else default
+        st.session_state[key] = dataset['names'][index]
+    return st.selectbox(label, dataset['names'], key=key)
+
+def set_region(param, level, name, code):
+    st.session_state[f'{param}-{level}'] = name
+    st.query_params[param] = code
+
+def peer_panel(dataset, level, region, param, side):
+    # Clicking a peer puts it on the other side of the comparison
+    codes = dict(zip(dataset['names'], dataset['codes']))
+    with st.expander(f"Regions most like {region}"):
+        found = peers.nearest(dataset['peers'], region, k=PEERS)
+        if not found:
+            st.caption("Not enough data to compare.")
+        for name, distance, shared in found:
+            st.button(
+                f"{name} ({distance:.1f} pts)", key=f'peer-{side}-{codes[name]}', on_click=set_region, args=(param, level, name, codes[name]),
+                help=f"Root mean square gap in percentile rank across {shared} indicators", use_container_width=True
+            )
+
+@st.fragment
+def lazy_carousel(data, indicators, regions, driver, index):
+    # Only the slide in view is built; moving the slider reruns just this fragment
+    indicator = st.select_slider("Indicator:", options=indicators, key='carousel_indicator', label_visibility='collapsed')
+    bar = visualisations.bar(data, indicator, regions, driver[indicator][0], index=index)
+    st.plotly_chart(bar, use_container_width=True, key=f'bar-{indicator}')
+
+@st.fragment
+@recorded
+def comparison():
+    # Reruns by itself when a region changes, leaving the header, footer and styles alone. The dataset is
+    # fetched here rather than passed in, as fragment reruns reuse their arguments and would miss a reload
+    levels = list(data_partitions().levels)
+    cols = st.columns([1,2,1])
+
+    # Geography level, only offered when there is data for more than one
+    level = st.query_params.get('level', data_prep.DEFAULT_LEVEL).upper()
+    level = level if level in levels else data_prep.DEFAULT_LEVEL
+    if len(levels) > 1:
+        with cols[1]:
+            level = st.selectbox("Geography:", levels, index=levels.index(level))
+    dataset = current_dataset(level)
+    all_data = dataset['all_data']
+    region_index = dataset['region_index']
+
+    driver = data_prep.DRIVER
+    # Filter indicator
+    indicators = list(driver.keys())
+
+    with timing.span('selection'):
+        # Headline indicator for the gauges, e.g. ?indicator=Export Intensity; the carousel shows the rest
+        requested = st.query_params.get('indicator', '').lower()
+        matches = [i for i, indicator in enumerate(indicators) if indicator.lower() == requested]
+        with cols[1]:
+            selected_indicator = st.selectbox("Headline indicator:", indicators, index=matches[0] if matches else 0)
+        others = [indicator for indicator in indicators if indicator != selected_indicator]
+
+        # Filter region (data arrives sorted by name and year)
+        code = dataset['codes']
+        itl3 = dataset['names']
+        query_params = {k.lower(): v.upper() for k, v in st.query_params.items()}
+        with cols[0]:
+            selected_itl3_1 = region_select(f"Select First {level} Region:", dataset, level, query_params, 'region_1', 0)
+        with cols[2]:
+            selected_itl3_2 = region_select(f"Select Second {level} Region:", dataset, level, query_params, 'region_2', 1)
+
+        # Further regions for the time series and bar charts, e.g. ?compare=TLC31,TLC32
+        compare = [itl3[code.index(c)] for c in query_params.get('compare', '').split(',') if c in code]
+        with cols[1]:
+            more = st.multiselect(f"Compare more {level} regions:", itl3, default=compare[:MAX_REGIONS - 2], max_selections=MAX_REGIONS - 2)
+        regions = [selected_itl3_1, selected_itl3_2] + [region for region in more if region not in (selected_itl3_1, selected_itl3_2)]
+
+    # Create placeholders for the charts
+    gauge_1_placeholder = cols[0].empty()
+    time_series_placeholder = cols[1].empty()
+    gauge_2_placeholder = cols[2].empty()
+    spider_1_placeholder = cols[0].empty()
+    spider_2_placeholder = cols[2].empty()
+
+    # Create a charts
+    with timing.span('region_charts'):
+        gauge_1, spider_1 = region_charts(dataset, selected_itl3_1, selected_indicator, payloads.COLOURS[0])
+    with timing.span('time_series'):
+        time_series = cached(dataset, figure_cache(), ('time_series', *regions))
+    with timing.span('region_charts'):
+        gauge_2, spider_2 = region_charts(dataset, selected_itl3_2, selected_indicator, payloads.COLOURS[1])
     
-    st.markdown(
-    f"""
+    with timing.span('show_charts'):
+        show_chart(gauge_1_placeholder, gauge_1, f'gauge-{selected_itl3_1}-1-final', animations.gauge_frames)
+        show_chart(spider_1_placeholder, spider_1, f'spider-{selected_itl3_1}-1-final', animations.spider_frames)
+
+        show_chart(gauge_2_placeholder, gauge_2, f'gauge-{selected_itl3_2}-2-final', animations.gauge_frames)
+        show_chart(spider_2_placeholder, spider_2, f'spider-{selected_itl3_2}-2-final', animations.spider_frames)
+
+        show_chart(time_series_placeholder, time_series, f'time-series-final', animations.time_series_frames)
+
+    with timing.span('peers'):
+        with cols[0]:
+            peer_panel(dataset, level, selected_itl3_1, 'region_2', 1)
+        with cols[2]:
+            peer_panel(dataset, level, selected_itl3_2, 'region_1', 2)
+
+    with cols[1], timing.span('carousel'):
+        if settings.CAROUSEL_MODE == 'lazy':
+            lazy_carousel(all_data, others, regions, driver, region_index)
+        else:
+            eager_carousel(dataset, others, regions)
+
+@st.cache_resource(show_spinner=False)
+def page_html():
+    # Header and footer with their images inlined, encoded once per process rather than on every rerun
+    def img_to_base64(path):
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode()
+
+    logo_base64 = img_to_base64("static/logo.png")
+    figshare_base64 = img_to_base64("static/Figshare_logo.png")
+    cc_base64 = img_to_base64("static/cc.xlarge.png")
+
+    header = f"""
+        <div style="
+            display: flex;
+            align-items: center;
+            justify-content: space-between;
+            width: 200w;
+            margin: -45px -80px 10px -80px;
+            background-color: #ffffff;
+            padding: 10px 50px;
+            box-shadow: 0 4px 6px rgba(0,0,0,0.12);
+            position: relative;
+        ">
+            <a href='https://lab.productivity.ac.uk/' target='_blank'>
+                <img src='data:image/png;base64,{logo_base64}' style='height:30px;'>
+            </a>
+            <a href='https://doi.org/10.48420/30030220' target='_blank'>
+                <img src='data:image/png;base64,{figshare_base64}' style='height:50px;'>
+            </a>
+        </div>
+        """
+
+    footer = f"""
     <style>
     .bottom-right-image {{
         position: fixed;
@@ -304,13 +354,43 @@ async def main():
             <img src='data:image/png;base64,{cc_base64}' style='height:30px;'>
         </a>
     </div>
-    """,
-    unsafe_allow_html=True
-)
+    """
+    return header, footer
 
-    
-    # await asyncio.gather(*tasks)
-    
+@recorded
+def main():
+    st.set_page_config(layout="wide", page_title="ITL3 Compare")
+
+    with timing.span('header'):
+        header, footer = page_html()
+        st.markdown(header, unsafe_allow_html=True)
+
+    st.markdown("""
+    <style>
+    /* Target each column container */
+    div[data-testid="stVerticalBlock"] > div[data-testid="stHorizontalBlock"] > div {
+        border: 1px solid #e0e0e0;
+        border-radius: 12px;
+        padding: 18px;
+        margin: 2px;
+        background-color: #ffffff;
+        box-shadow: 0 4px 6px rgba(0,0,0,0.12);
+    }
+    /* Change main background color */
+    .stApp {
+        background-color: #6b739c;
+        min-width: 1500px; /* app won't shrink smaller than this */
+    }
+    </style>
+    """, unsafe_allow_html=True)
+
+    # The comparison below reruns as a fragment when a region changes
+    comparison()
+
+    st.markdown(footer, unsafe_allow_html=True)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    main()
+    if timing_enabled():
+        with st.sidebar:
+            timing_panel()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import numpy as np
+import plotly.io as pio
+import assets
+
+'''
+Chart animations computed in one pass and played back by Plotly.js in the browser.
+
+Each *_frames function returns (frames, durations): Plotly frame dicts that only carry the animated trace
+properties, and the milliseconds to hold each one. html() ships the figure and all of its frames in a
+single payload, so the server does no work per frame.
+'''
+
+def _durations(frames, base, growth):
+    # Seconds per frame easing out towards the end, as the old server-side loops slept
+    return (1000 * (base + growth * np.linspace(0, 1, frames) ** 4)).round().astype(int).tolist()
+
+def gauge_frames(fig, frames=80):
+    value = fig.data[0].value
+    if value is None or np.isnan(value):
+        return [], []
+    # Sweep the needle up from the bottom of the axis
+    steps = np.linspace(fig.data[0].gauge.axis.range[0], value, num=frames)
+    steps[-1] = round(value, 3)
+    return [{'data': [{'value': v}], 'traces': [0]} for v in steps.tolist()], _durations(frames, 0.01, 0.08)
+
+def spider_frames(fig, frames=80, start=20):
+    final_r = np.array(fig.data[0].r, dtype=float)
+    # Every frame's radii at once: start + t * (final - start)
+    r = start + np.outer(np.linspace(0, 1, frames), final_r - start)
+    return [{'data': [{'r': row}], 'traces': [0]} for row in r.tolist()], _durations(frames, 0.03, 0.0)
+
+def time_series_frames(fig, frames=80, traces=None):
+    # Draw each region's line from left to right, interpolating the point at the leading edge. Trace 0
+    # is the UK line, which is shown from the start. A region without data has nothing to draw, so its
+    # empty trace is left as it is
+    traces = range(1, len(fig.data)) if traces is None else traces
+    traces = [trace for trace in traces if fig.data[trace].x is not None and len(fig.data[trace].x)]
+    if not traces:
+        return [], []
+    progress = np.linspace(0, 1, frames)
+    series = []
+    for trace in traces:
+        x = np.asarray(fig.data[trace].x, dtype=float)
+        y = np.asarray(fig.data[trace].y, dtype=float)
+        position = progress * (len(x) - 1)
+        edge_x = np.interp(position, np.arange(len(x)), x)
+        edge_y = np.interp(position, np.arange(len(y)), y)
+        series.append((x, y, np.floor(position).astype(int), edge_x, edge_y))
+
+    # Plain lists rather than NumPy arrays, which would be serialised as typed-array specs
+    animation = []
+    for k in range(frames):
+        data = []
+        for x, y, whole, edge_x, edge_y in series:
+            data.append({
+                'x': np.append(x[:whole[k] + 1], edge_x[k]).tolist(),
+                'y': np.append(y[:whole[k] + 1], edge_y[k]).tolist(),
+            })
+        animation.append({'data': data, 'traces': traces})
+    return animation, _durations(frames, 0.02, 0.1)
+
+def html(fig, frames, durations, self_hosted=False):
+    figure = fig.to_dict()
+    # Start from the first frame so the final state never flashes up before playback
+    if frames:
+        for trace, update in zip(frames[0]['traces'], frames[0]['data']):
+            figure['data'][trace].update(update)
+    height = figure['layout'].get('height') or 450
+    return f"""
+    {assets.plotly_html(self_hosted)}
+    <style>body {{margin: 0;}}</style>
+    <div id="chart" style="height:{height}px; width:100%;"></div>
+    <script type="text/javascript">
+    var figure = {pio.json.to_json_plotly(figure)};
+    var frames = {pio.json.to_json_plotly(frames)};
+    var durations = {pio.json.to_json_plotly(durations)};
+    Plotly.newPlot('chart', figure.data, figure.layout, {{responsive: true}}).then(function (chart) {{
+        if (frames.length) {{
+            Plotly.animate(chart, frames, {{
+                frame: durations.map(function (duration) {{ return {{duration: duration, redraw: true}}; }}),
+                transition: {{duration: 0}},
+                mode: 'immediate'
+            }});
+        }}
+    }});
+    </script>
+    """, height
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+import data_prep
+import data_store
+import render_cache
+import settings
+import timing
+
+'''
+Read-only JSON API over the data behind the charts, for scripts that would otherwise scrape the app.
+
+    GET /api/regions[?level=ITL3]
+    GET /api/compare?region_1=TLC31[&region_2=TLC32][&level=ITL3]
+
+Regions are picked by the same codes as the app's region_1/region_2 query parameters. A comparison has,
+for each region, every indicator's gauge (reference-year value and UK median), percentile rank and
+yearly series, plus its GVA per hour time series, and the UK series. Shares are fractions, as stored.
+
+Responses are built from the app's datasets and cached by dataset version. Each carries an ETag hashed
+from its body, so a client sending If-None-Match gets an empty 304 until the data changes. serve.py runs
+this in a process of its own when ITL3_API_PORT is set, or run it by itself:
+
+    python api.py --port 8081
+'''
+
+logger = logging.getLogger('itl3_compare.api')
+
+# Budget for cached response bodies
+CACHE_BYTES = 16 * 1024 * 1024
+
+def _floats(values):
+    # Each value at its stored precision, e.g. a float32 GVA/H index of 103.1 rather than 103.0999984741211,
+    # and null if missing
+    return [None if np.isnan(value) else float(str(value)) for value in values]
+
+def _series(index, code, column):
+    rows = index['slices'][code]
+    years, values = index['year'][rows], index['columns'][column][rows]
+    keep = ~np.isnan(values)
+    return {'year': years[keep].tolist(), 'value': _floats(values[keep])}
+
+def regions(dataset, level):
+    return {
+        'version': dataset['version'],
+        'level': level,
+        'regions': [{'code': code, 'name': name} for code, name in zip(dataset['codes'], dataset['names'])],
+    }
+
+def compare(dataset, level, codes):
+    index = dataset['region_index']
+    names = dict(zip(dataset['codes'], dataset['names']))
+    ranks = dataset['spider_ranks']
+    uk = dataset['uk_data'][['year', 'GVA/H volume']].dropna()
+    result = {
+        'version': dataset['version'],
+        'level': level,
+        'uk': {'year': uk['year'].tolist(), 'value': _floats(uk['GVA/H volume'].to_numpy())},
+        'regions': [],
+    }
+    for code in codes:
+        name = names[code]
+        indicators = {}
+        for indicator in data_prep.DRIVER:
+            stats = dataset['gauge_stats'][indicator]
+            series = _series(index, code, indicator)
+            year = int(stats['year'])
+            value = series['value'][series['year'].index(year)] if year in series['year'] else None
+            indicators[indicator] = {
+                'gauge': {'year': year, 'value': value, 'median': _floats([stats['median']])[0]},
+                'percentile': _floats([ranks['percentiles'].at[name, indicator]])[0],
+                'series': series,
+            }
+        result['regions'].append({
+            'code': code,
+            'name': name,
+            'time_series': _series(index, code, 'GVA/H volume'),
+            'indicators': indicators,
+        })
+    return result
+
+class Handler(tornado.web.RequestHandler):
+    def initialize(self, partitions, cache):
+        self.partitions = partitions
+        self.cache = cache
+
+    def dataset(self):
+        level = self.get_argument('level', data_prep.DEFAULT_LEVEL).upper()
+        if level not in self.partitions.levels:
+            raise tornado.web.HTTPError(404, reason=f'No data for geography level {level}')
+        return level, self.partitions.get(level).current()
+
+    def respond(self, key, build):
+        # The body and its ETag are made once per dataset version; Tornado answers If-None-Match with a 304
+        body, self.etag = self.cache.get_or_create(key, lambda: self.encode(build()))
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(body)
+
+    def encode(self, payload):
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+        return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    def compute_etag(self):
+        return getattr(self, 'etag', None)
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'error': self._reason}))
+
+class RegionsHandler(Handler):
+    def get(self):
+        level, dataset = self.dataset()
+        self.respond((dataset['version'], 'regions'), lambda: regions(dataset, level))
+
+class CompareHandler(Handler):
+    def get(self):
+        level, dataset = self.dataset()
+        codes = [self.get_argument(param).strip().upper() for param in ('region_1', 'region_2') if self.get_argument(param, '').strip()]
+        if not codes:
+            raise tornado.web.HTTPError(400, reason='Give a region code as region_1, and optionally region_2')
+        unknown = [code for code in codes if code not in dataset['codes']]
+        if unknown:
+            raise tornado.web.HTTPError(404, reason=f"Unknown {level} region codes: {', '.join(unknown)}")
+        self.respond((dataset['version'], 'compare', *codes), lambda: compare(dataset, level, codes))
+
+def application(partitions):
+    cache = render_cache.LRUCache(CACHE_BYTES, sizeof=lambda entry: len(entry[0]))
+    # Responses built from a replaced or dropped dataset can never be asked for again
+    partitions.on_swap(lambda old, new: cache.evict(lambda key: key[0] == old))
+    handlers = {'partitions': partitions, 'cache': cache}
+    return tornado.web.Application([
+        (r'/api/regions', RegionsHandler, handlers),
+        (r'/api/compare', CompareHandler, handlers),
+    ])
+
+def serve(partitions, port, address=''):
+    # Runs on its own thread and event loop, so requests never wait on the Streamlit server's. The port is
+    # bound here, so a port already in use raises in the caller
+    sockets = tornado.netutil.bind_sockets(port, address)
+    app = application(partitions)
+
+    async def run():
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets(sockets)
+        await asyncio.Event().wait()
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),), name='itl3-api', daemon=True)
+    thread.start()
+    timing.log_event(logger, 'api', state='listening', port=port)
+    return thread
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the JSON API on its own')
+    parser.add_argument('--port', type=int, default=settings.API_PORT or 8081)
+    parser.add_argument('--address', default='')
+    parser.add_argument('--exit-with-parent', action='store_true', help='Exit once the process that started this one has')
+    args = parser.parse_args()
+    if args.exit_with_parent:
+        # serve.py may exec into `streamlit run`, which won't stop this process when it exits itself
+        parent = os.getppid()
+
+        def watch():
+            while os.getppid() == parent:
+                time.sleep(2)
+            os._exit(0)
+
+        threading.Thread(target=watch, name='itl3-api-parent', daemon=True).start()
+    partitions = data_store.Partitions(poll_seconds=settings.DATA_POLL_SECONDS, idle_seconds=settings.PARTITION_IDLE_SECONDS)
+    serve(partitions, args.port, args.address).join()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import sys
+import urllib.request
+import plotly.offline
+import streamlit as st
+import streamlit.components.v1 as components
+
+'''
+Plotly.js and Bootstrap for the embedded carousel, served once from static/vendor instead of public CDNs.
+
+Streamlit's static/ route serves .js and .css as text/plain, so the vendor directory is registered as a
+component path instead: that route sends the right Content-Type and Cache-Control: public. File names
+carry the library version, so browsers can keep them cached across deployments.
+'''
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vendor')
+
+PLOTLY_VERSION = plotly.offline.get_plotlyjs_version()
+BOOTSTRAP_VERSION = '5.1.3'
+
+PLOTLY_JS = f'plotly-{PLOTLY_VERSION}.min.js'
+BOOTSTRAP_CSS = f'bootstrap-{BOOTSTRAP_VERSION}.min.css'
+BOOTSTRAP_JS = f'bootstrap-{BOOTSTRAP_VERSION}.bundle.min.js'
+
+CDN_URLS = {
+    PLOTLY_JS: f'https://cdn.plot.ly/plotly-{PLOTLY_VERSION}.min.js',
+    BOOTSTRAP_CSS: f'https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/css/bootstrap.min.css',
+    BOOTSTRAP_JS: f'https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}/dist/js/bootstrap.bundle.min.js',
+}
+
+def available(vendor_dir=VENDOR_DIR):
+    return {filename for filename in CDN_URLS if os.path.exists(os.path.join(vendor_dir, filename))}
+
+def urls(self_hosted):
+    # Each file falls back to its CDN when asked to, or when it hasn't been built (e.g. a compose volume
+    # mount, or Bootstrap on a build without internet access)
+    built = available() if self_hosted else set()
+    if not built:
+        return dict(CDN_URLS)
+    vendor = components.declare_component('vendor', path=VENDOR_DIR)
+    base = st.get_option('server.baseUrlPath').strip('/')
+    prefix = f"/{base}/component/{vendor.name}" if base else f"/component/{vendor.name}"
+    return {filename: f"{prefix}/{filename}" if filename in built else url for filename, url in CDN_URLS.items()}
+
+def plotly_html(self_hosted):
+    # Load Plotly once for every figure rendered with include_plotlyjs=False
+    return f"""
+    <script type="text/javascript">window.PlotlyConfig = {{MathJaxConfig: 'local'}};</script>
+    <script charset="utf-8" src="{urls(self_hosted)[PLOTLY_JS]}"></script>
+    """
+
+def bootstrap_html(self_hosted):
+    vendor_urls = urls(self_hosted)
+    return f"""
+    <link href="{vendor_urls[BOOTSTRAP_CSS]}" rel="stylesheet">
+    <script src="{vendor_urls[BOOTSTRAP_JS]}"></script>
+    """
+
+def build(vendor_dir=VENDOR_DIR):
+    os.makedirs(vendor_dir, exist_ok=True)
+    # Plotly.js ships inside the plotly package, so it always matches the figures we generate
+    with open(os.path.join(vendor_dir, PLOTLY_JS), 'w', encoding='utf-8') as f:
+        f.write(plotly.offline.get_plotlyjs())
+    for filename in (BOOTSTRAP_CSS, BOOTSTRAP_JS):
+        try:
+            with urllib.request.urlopen(CDN_URLS[filename], timeout=30) as response:
+                content = response.read()
+        except OSError as e:
+            # e.g. a build without internet access; urls() then keeps using the CDNs
+            print(f'Could not fetch {CDN_URLS[filename]} ({e}), so Bootstrap stays on its CDN', file=sys.stderr)
+            return False
+        with open(os.path.join(vendor_dir, filename), 'wb') as f:
+            f.write(content)
+    return True
+
+# Fetch the vendor files into static/vendor, e.g. while building the Docker image. Bootstrap can't be
+# fetched without internet access, which isn't an error: the app then falls back to the CDNs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default=VENDOR_DIR)
+    args = parser.parse_args()
+    build(args.output)
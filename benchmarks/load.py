@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from benchmarks.run import ROOT, APP, metadata, summarise
+
+'''
+Concurrent-session load test for the app, run on one machine with no external services.
+
+    python -m benchmarks.load --sessions 1 --sessions 5 --sessions 10 --sessions 25 --output load.json
+
+For each --sessions level a fresh server is started and N simulated sessions connect to it over the same
+websocket the browser uses. Each session opens the page with random region_1/region_2 query parameters, then
+changes both region selectboxes --interactions times, rerunning the comparison fragment as the browser does.
+The report gives throughput, latency percentiles and the server's RSS growth per session at each level;
+throughput that stops rising as sessions are added marks where the single server process saturates.
+
+Pass --url to test a server that is already running (e.g. the compose container), adding --pid when its
+process is visible from here to include memory figures.
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def rss_mb(pid):
+    # Resident set size from /proc, which is all a Linux container needs
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def wait_healthy(url, process=None, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('Server exited before becoming healthy')
+        try:
+            with urllib.request.urlopen(f'{url}/_stcore/health', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} not healthy after {timeout}s')
+
+@contextlib.contextmanager
+def serve(env):
+    # A fresh server per level, so memory and caches start from the same baseline
+    port = free_port()
+    command = [sys.executable, '-m', 'streamlit', 'run', APP, '--server.headless', 'true',
+               '--server.port', str(port), '--server.address', '127.0.0.1',
+               '--browser.gatherUsageStats', 'false', '--server.fileWatcherType', 'none']
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        url = f'http://127.0.0.1:{port}'
+        try:
+            wait_healthy(url, process)
+            yield url, process.pid
+        except RuntimeError:
+            log.seek(0)
+            sys.stderr.write(log.read().decode(errors='replace'))
+            raise
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def rerun_message(query_string, widget_states=(), fragment_id=''):
+    message = BackMsg()
+    message.rerun_script.query_string = query_string
+    message.rerun_script.page_script_hash = ''
+    message.rerun_script.fragment_id = fragment_id
+    for widget_id, value in widget_states:
+        state = message.rerun_script.widget_states.widgets.add()
+        state.id = widget_id
+        state.int_value = value
+    return message.SerializeToString()
+
+async def run_script(ws, message, timeout):
+    # Sends one rerun and reads until the server reports the script finished
+    await ws.write_message(message, binary=True)
+    received = 0
+    selectboxes, fragment_id, errors = [], '', 0
+    while True:
+        data = await asyncio.wait_for(ws.read_message(), timeout)
+        if data is None:
+            raise ConnectionError('Websocket closed by the server')
+        received += len(data)
+        msg = ForwardMsg()
+        msg.ParseFromString(data)
+        kind = msg.WhichOneof('type')
+        if kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+            element = msg.delta.new_element
+            if element.WhichOneof('type') == 'selectbox':
+                selectboxes.append(element.selectbox)
+                fragment_id = fragment_id or msg.delta.fragment_id
+            elif element.WhichOneof('type') == 'exception':
+                errors += 1
+        elif kind == 'script_finished':
+            return received, selectboxes, fragment_id, errors
+
+async def session(url, codes, interactions, rng, think, timeout, finished=None, hold=None):
+    # With finished and hold, reports its result then stays connected until hold is set
+    result = {'first_run': None, 'latencies': [], 'bytes': [], 'errors': 0, 'failed': None}
+    first, second = rng.sample(codes, 2)
+    query_string = f'region_1={first}&region_2={second}'
+    try:
+        ws = await websocket_connect(url.replace('http', 'ws', 1) + '/_stcore/stream')
+    except Exception as e:
+        result['failed'] = f'connect: {e}'
+        if finished is not None:
+            finished.set_result(result)
+        return result
+    try:
+        start = time.perf_counter()
+        received, selectboxes, fragment_id, errors = await run_script(ws, rerun_message(query_string), timeout)
+        result['first_run'] = time.perf_counter() - start
+        result['errors'] += errors
+        # The two region selectboxes, found by label so the indicator select is left alone
+        regions = [box for box in selectboxes if box.label.endswith('Region:')]
+        if len(regions) != 2:
+            raise RuntimeError('Region selectboxes not found')
+        for _ in range(interactions):
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+            choice = rng.sample(range(len(regions[0].options)), 2)
+            message = rerun_message(query_string, [(box.id, value) for box, value in zip(regions, choice)], fragment_id)
+            start = time.perf_counter()
+            received, _, _, errors = await run_script(ws, message, timeout)
+            result['latencies'].append(time.perf_counter() - start)
+            result['bytes'].append(received)
+            result['errors'] += errors
+    except Exception as e:
+        result['failed'] = f'{type(e).__name__}: {e}'
+    if finished is not None:
+        finished.set_result(result)
+        await hold.wait()
+    ws.close()
+    return result
+
+async def sample_rss(pid, samples, stop, interval=0.2):
+    while not stop.is_set():
+        samples.append(rss_mb(pid))
+        await asyncio.sleep(interval)
+
+async def run_level(url, pid, sessions, codes, args):
+    # One warm-up session loads the dataset, so the baseline excludes it and growth is down to sessions
+    await session(url, codes, 1, random.Random(args.seed), 0, args.timeout)
+    baseline = rss_mb(pid) if pid else None
+
+    samples, stop = [], asyncio.Event()
+    sampler = asyncio.ensure_future(sample_rss(pid, samples, stop)) if pid else None
+    loop = asyncio.get_running_loop()
+    finished, hold = [loop.create_future() for _ in range(sessions)], asyncio.Event()
+    start = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(session(url, codes, args.interactions, random.Random(f'{args.seed}-{sessions}-{k}'),
+                                      args.think, args.timeout, finished[k], hold))
+        for k in range(sessions)
+    ]
+    results = await asyncio.gather(*finished)
+    elapsed = time.perf_counter() - start
+    # Measured before the sessions disconnect, while the server still holds their state
+    held = rss_mb(pid) if pid else None
+    hold.set()
+    await asyncio.gather(*tasks)
+    if sampler:
+        stop.set()
+        await sampler
+
+    latencies = [t for r in results for t in r['latencies']]
+    first_runs = [r['first_run'] for r in results if r['first_run'] is not None]
+    report = {
+        'sessions': sessions,
+        'interactions': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'failed_sessions': sum(r['failed'] is not None for r in results),
+        'errors': sum(r['errors'] for r in results),
+        'first_run': summarise(first_runs) if first_runs else None,
+        'rerun': summarise(latencies) if latencies else None,
+        'kb_per_rerun': round(sum(b for r in results for b in r['bytes']) / len(latencies) / 1024, 1) if latencies else None,
+    }
+    failures = [r['failed'] for r in results if r['failed']]
+    if failures:
+        report['failures'] = sorted(set(failures))[:5]
+    if baseline is not None and held is not None:
+        peak = max((s for s in samples if s is not None), default=held)
+        report['rss_mb'] = {
+            'baseline': round(baseline, 1),
+            'held': round(held, 1),
+            'peak': round(peak, 1),
+            'per_session': round((held - baseline) / sessions, 2),
+        }
+    return report
+
+def saturation(levels):
+    # The first level where adding sessions bought less than 10% more throughput
+    for previous, level in zip(levels, levels[1:]):
+        if previous['throughput_rps'] and level['throughput_rps'] < previous['throughput_rps'] * 1.1:
+            return previous['sessions']
+    return None
+
+def print_table(levels):
+    print(f"{'sessions':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'failed':>6} {'MB/session':>10}", file=sys.stderr)
+    for level in levels:
+        rerun = level['rerun'] or {}
+        memory = level.get('rss_mb', {}).get('per_session', '')
+        print(f"{level['sessions']:>8} {level['throughput_rps'] or 0:>8.2f} {rerun.get('p50_ms', 0):>9.1f} "
+              f"{rerun.get('p95_ms', 0):>9.1f} {rerun.get('p99_ms', 0):>9.1f} {level['failed_sessions']:>6} {memory:>10}",
+              file=sys.stderr)
+
+def main(args):
+    import data_prep
+
+    codes = data_prep.load(data_prep.DATA_PATH)['code'].unique().tolist()
+    env = dict(os.environ)
+    if args.carousel:
+        env['ITL3_CAROUSEL_MODE'] = args.carousel
+
+    levels = []
+    for sessions in args.sessions:
+        print(f'Load testing {sessions} concurrent sessions', file=sys.stderr)
+        if args.url:
+            level = asyncio.run(run_level(args.url.rstrip('/'), args.pid, sessions, codes, args))
+        else:
+            with serve(env) as (url, pid):
+                level = asyncio.run(run_level(url, pid, sessions, codes, args))
+        levels.append(level)
+
+    report = {'metadata': metadata(), 'settings': vars(args), 'levels': levels, 'saturated_at': saturation(levels)}
+    print_table(levels)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, action='append', help='Concurrent sessions, repeatable (default 1, 5, 10, 25, 50)')
+    parser.add_argument('--interactions', type=int, default=10, help='Region changes per session')
+    parser.add_argument('--think', type=float, default=0, help='Mean seconds between interactions (default 0, back to back)')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for one rerun')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--carousel', choices=['eager', 'lazy'], help='ITL3_CAROUSEL_MODE for the servers started here')
+    parser.add_argument('--url', help='Load test a running server instead of starting one per level')
+    parser.add_argument('--pid', type=int, help='Process id of the --url server, for memory figures')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    args.sessions = args.sessions or [1, 5, 10, 25, 50]
+    main(args)
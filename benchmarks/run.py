@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+'''
+Rerun latency benchmarks for the app and the chart builders.
+
+    python -m benchmarks.run --scale 1:1 --scale 10:1 --scale 100:1 --output results.json
+
+Each --scale REGIONS:YEARS runs in its own process against synthetic data (1:1 is the real CSVs), so caches
+and memory never leak between scales. Results are written as JSON, tagged with the git commit, so runs on
+different commits can be diffed.
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'Streamlit_itl3-compare.py')
+
+def summarise(samples):
+    samples = np.asarray(samples) * 1000
+    return {
+        'n': len(samples),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def region_pairs(names, count, seed):
+    rng = random.Random(seed)
+    return [tuple(rng.sample(names, 2)) for _ in range(count)]
+
+def bench_builders(repeat, pairs):
+    import data_prep
+    import visualisations
+
+    results = {}
+    start = time.perf_counter()
+    dataset = data_prep.build_dataset()
+    results['data_prep.build_dataset'] = summarise([time.perf_counter() - start])
+    all_data, uk_data, index = dataset['all_data'], dataset['uk_data'], dataset['region_index']
+    results['data_prep.spider_ranks'] = summarise(timed(lambda: data_prep.spider_ranks(all_data), repeat))
+    results['data_prep.region_index'] = summarise(timed(lambda: data_prep.region_index(all_data, list(data_prep.DRIVER)), repeat))
+
+    indicator = 'GVA per hour worked'
+    year = data_prep.DRIVER[indicator][1]
+    median = all_data.loc[all_data['year'] == int(year), indicator].median()
+    bounds = [median * 0.85, median * 1.25]
+    builders = {
+        'gauge': lambda a, b: visualisations.gauge(all_data, a, indicator, year, bounds, index=index),
+        'time_series': lambda a, b: visualisations.time_series(all_data, [a, b], uk_data, index=index),
+        'spider': lambda a, b: visualisations.spider(dataset['spider_ranks'], a, '#eb5e5e'),
+        'bar': lambda a, b: visualisations.bar(all_data, 'Export Intensity', [a, b], data_prep.DRIVER['Export Intensity'][0], index=index),
+    }
+    for name, build in builders.items():
+        build_samples, html_samples, json_samples = [], [], []
+        for _ in range(repeat):
+            for a, b in pairs:
+                start = time.perf_counter()
+                fig = build(a, b)
+                built = time.perf_counter()
+                fig.to_html(full_html=False, include_plotlyjs=False)
+                html = time.perf_counter()
+                fig.to_json()
+                build_samples.append(built - start)
+                html_samples.append(html - built)
+                json_samples.append(time.perf_counter() - html)
+        results[f'visualisations.{name}'] = summarise(build_samples)
+        results[f'visualisations.{name}.to_html'] = summarise(html_samples)
+        results[f'visualisations.{name}.to_json'] = summarise(json_samples)
+    return results
+
+def bench_app(pairs):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=600)
+    start = time.perf_counter()
+    app.run()
+    results = {'app.first_run': summarise([time.perf_counter() - start])}
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+
+    samples = []
+    for a, b in pairs:
+        # Found by label, as the headline indicator and geography are selectboxes too
+        first, second = [box for box in app.selectbox if box.label.endswith('Region:')]
+        first.set_value(a)
+        second.set_value(b)
+        start = time.perf_counter()
+        app.run()
+        samples.append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    results['app.rerun'] = summarise(samples)
+    return results
+
+# Run in a fresh interpreter under -X importtime, as a new server process would see its first page load
+COLD_START = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+print('cold-start-app', file=sys.stderr, flush=True)
+start = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=600).run()
+first = time.perf_counter()
+app.run()
+print(json.dumps({'first_run': first - start, 'second_run': time.perf_counter() - first, 'errors': len(app.exception)}))
+'''
+
+def parse_importtime(stderr, marker='cold-start-app'):
+    # Top-level modules imported after the marker, i.e. by the app rather than Streamlit, with cumulative seconds
+    imports = {}
+    lines = stderr.splitlines()
+    for line in lines[lines.index(marker) + 1 if marker in lines else 0:]:
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if not name.startswith('  ') and cumulative.strip().isdigit():
+                imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+def bench_cold_start(top=15):
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', COLD_START, APP],
+                            cwd=ROOT, capture_output=True, text=True)
+    if output.returncode:
+        sys.stderr.write(output.stderr)
+        raise RuntimeError('Cold start run failed')
+    runs = json.loads(output.stdout.strip().splitlines()[-1])
+    if runs['errors']:
+        raise RuntimeError('The app raised an exception on a cold start')
+    imports = parse_importtime(output.stderr)
+    return {
+        'app.cold_start.first_run': summarise([runs['first_run']]),
+        'app.cold_start.second_run': summarise([runs['second_run']]),
+        'app.cold_start.imports': summarise([sum(imports.values())]),
+        # Slowest imports made by the app's first run, in ms, to see what deferring would save
+        'app.cold_start.slowest_imports': {name: round(seconds * 1000, 1) for name, seconds in
+                                           sorted(imports.items(), key=lambda item: -item[1])[:top]},
+    }
+
+def child(args):
+    import data_prep
+
+    names = data_prep.build_dataset()['names']
+    pairs = region_pairs(names, args.pairs, args.seed)
+    results = bench_builders(args.repeat, pairs)
+    if not args.skip_app:
+        results.update(bench_cold_start())
+        results.update(bench_app(pairs))
+    json.dump(results, sys.stdout)
+
+def metadata():
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import pandas
+    import plotly
+    import streamlit
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': {'pandas': pandas.__version__, 'plotly': plotly.__version__, 'streamlit': streamlit.__version__},
+    }
+
+def main(args):
+    from benchmarks import synthetic
+
+    report = {'metadata': metadata(), 'settings': vars(args), 'scales': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for spec in args.scale:
+            regions, years = (int(part) for part in spec.split(':'))
+            env = dict(os.environ)
+            if (regions, years) != (1, 1):
+                env['ITL3_DATA_PATH'], env['ITL3_UK_DATA_PATH'] = synthetic.write(directory, regions, years, args.seed)
+            command = [sys.executable, '-m', 'benchmarks.run', '--child', '--repeat', str(args.repeat),
+                       '--pairs', str(args.pairs), '--seed', str(args.seed)]
+            if args.skip_app:
+                command.append('--skip-app')
+            print(f'Benchmarking scale {spec}', file=sys.stderr)
+            output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+            if output.returncode:
+                sys.stderr.write(output.stderr)
+                raise SystemExit(f'Scale {spec} failed')
+            report['scales'][spec] = json.loads(output.stdout)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', action='append', help='REGIONS:YEARS multipliers, repeatable (default 1:1, 10:1, 100:1)')
+    parser.add_argument('--pairs', type=int, default=20, help='Random region pairs per benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-app', action='store_true', help='Only benchmark the chart builders')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        args.scale = args.scale or ['1:1', '10:1', '100:1']
+        main(args)
@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import pandas as pd
+import data_prep
+
+'''Synthetic datasets shaped like the real CSVs, with the region and year counts scaled up'''
+
+def scale(data, regions=1, years=1, seed=0):
+    rng = np.random.default_rng(seed)
+    values = [column for column in data.columns if column not in ('code', 'name', 'year')]
+
+    # Extra regions are noisy copies of the real ones with their own codes and names
+    copies = [data]
+    for k in range(1, regions):
+        copy = data.copy()
+        copy['code'] = copy['code'] + f'_{k}'
+        copy['name'] = copy['name'] + f' ({k})'
+        copy[values] = copy[values] * rng.lognormal(0, 0.05, size=(len(copy), len(values)))
+        copies.append(copy)
+    data = pd.concat(copies, ignore_index=True)
+
+    # Extra years go before the real ones, so the base and reference years still exist
+    span = data['year'].max() - data['year'].min() + 1
+    copies = [data]
+    for k in range(1, years):
+        copy = data.copy()
+        copy['year'] = copy['year'] - k * span
+        copy[values] = copy[values] * rng.lognormal(0, 0.05, size=(len(copy), len(values)))
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+def write(directory, regions=1, years=1, seed=0):
+    # Returns (data path, UK data path) for ITL3_DATA_PATH and ITL3_UK_DATA_PATH
+    os.makedirs(directory, exist_ok=True)
+    data_path = os.path.join(directory, f'itl3_compare_data_r{regions}_y{years}.csv')
+    uk_data_path = os.path.join(directory, f'itl3_compare_uk_data_y{years}.csv')
+    scale(pd.read_csv(data_prep.DATA_PATH), regions, years, seed).to_csv(data_path, index=False)
+    scale(pd.read_csv(data_prep.UK_DATA_PATH), 1, years, seed).to_csv(uk_data_path, index=False)
+    return data_path, uk_data_path
@@ -0,0 +1,192 @@
+import argparse
+import hashlib
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import timing
+import peers
+
+'''Turns the source CSVs into the frames the app and visualisations read from'''
+
+# Overridable so benchmarks and alternative datasets can point the app elsewhere
+DATA_PATH = os.environ.get('ITL3_DATA_PATH', 'src/itl3_compare_data.csv')
+UK_DATA_PATH = os.environ.get('ITL3_UK_DATA_PATH', 'src/itl3_compare_uk_data.csv')
+BASE_YEAR = 2008
+
+# Geography level: regional data; levels whose file isn't on disk are left out, and every level shares the UK data
+LEVELS = {
+    'ITL1': os.environ.get('ITL3_ITL1_DATA_PATH', 'src/itl1_compare_data.csv'),
+    'ITL2': os.environ.get('ITL3_ITL2_DATA_PATH', 'src/itl2_compare_data.csv'),
+    'ITL3': DATA_PATH,
+    'LAD': os.environ.get('ITL3_LAD_DATA_PATH', 'src/lad_compare_data.csv'),
+}
+DEFAULT_LEVEL = 'ITL3'
+
+# Parquet metadata key recording which CSV an artefact was built from, and in which format
+SOURCE_HASH_KEY = b'itl3_source_hash'
+
+# Bump whenever prepare() or compact() change, so artefacts built by older code are ignored
+ARTEFACT_FORMAT = 2
+
+# Indicator: [description, reference year, first year, source link]
+DRIVER = {
+    'GVA per hour worked': ['Productivity measured as Gross Value Added per hour worked', '2023', '2004', '<a href="https://www.ons.gov.uk/employmentandlabourmarket/peopleinwork/labourproductivity/datasets/subregionalproductivitylabourproductivitygvaperhourworkedandgvaperfilledjobindicesbyuknuts2andnuts3subregions" target="_blank">Source</a>'],
+    'Export Intensity': ['Exports as a percentage of GDP ', '2023', '2016', '<a href="https://www.ons.gov.uk/businessindustryandtrade/internationaltrade/datasets/subnationaltradeingoods" target="_blank">Source</a>'],
+    'New Businesses': ['New firms as a percentage of total active firms', '2023', '2017', '<a href="https://www.ons.gov.uk/businessindustryandtrade/business/activitysizeandlocation/datasets/businessdemographyreferencetable" target="_blank">Source</a>'],
+    'Low Skilled': ["Percentage of the working-age population with NVQ1/RQF1 or ‘no qualifications’", '2024', '2016', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
+    'High Skilled': ["Percentage of the working-age population with qualification at NVQ4+/RQF4+ level", '2024', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
+    'Active': ['Percentage of the working-age population active in employment', '2024', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
+    'Inactive due to Illness': ['Percentage of <i>inactive</i> working age population, inactive due to ill health', '2024', '2014', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
+    'Working Age': ['Percentage of the total population that are of working age (aged 16-64)', '2023', '2012', '<a href="https://www.nomisweb.co.uk/datasets/apsnew" target="_blank">Source</a>'],
+    '5G connectivity': ['Percentage of outdoor areas with 5G service access from at least one mobile network operator', '2025', '2023', '<a href="https://www.ofcom.org.uk/research-and-data/multi-sector-research/infrastructure-research" target="_blank">Source</a>'],
+    'Gigabit connectivity': ['Percentage of premises that have access to a gigabit connection', '2025', '2021', '<a href="https://www.ofcom.org.uk/research-and-data/multi-sector-research/infrastructure-research" target="_blank">Source</a>'],
+    'GFCF per job': ['Gross fixed capital formation per job, total amount of investment in tangible and intangible assets', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>'],
+    'ICT per job': ['Total amount of investment in ICT equipment per job', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>'],
+    'Intangibles per job': ['Total amount of investment in intangible capital per job', '2020', '2008', '<a href="https://www.ons.gov.uk/economy/regionalaccounts/grossdisposablehouseholdincome/datasets/experimentalregionalgrossfixedcapitalformationgfcfestimatesbyassettype" target="_blank">Source</a>']
+}
+
+# Lower values are better for these, so their percentiles are inverted
+OPPOSITE_INDICATORS = ['Low Skilled', 'Inactive due to Illness']
+
+def file_hash(path):
+    # Stat is cheap, so only re-read the file when it has actually changed on disk
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=32)
+def _file_hash(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def dataset_version(data_path=DATA_PATH, uk_data_path=UK_DATA_PATH):
+    return hashlib.sha256((file_hash(data_path) + file_hash(uk_data_path)).encode()).hexdigest()[:16]
+
+def rebase(data, column='GVA/H volume', year=BASE_YEAR):
+    # Index each region's series to 100 in the base year
+    base = data.loc[data['year'] == year, :].set_index('code')[column]
+    return (data[column] / data['code'].map(base)) * 100
+
+def prepare(data):
+    # Sorted by name then year so each region's rows are contiguous
+    data = data.sort_values(by=['name', 'year'], ignore_index=True)
+    data['GVA/H volume'] = rebase(data)
+    return data
+
+def compact(data):
+    # Categorical names and codes, small integer years and a float32 GVA/H index. The indicators stay
+    # float64: their values and medians are shown to 2 decimal places (e.g. £9,604.53), and float32 only
+    # holds about 7 significant digits
+    dtypes = {'code': 'category', 'name': 'category', 'year': 'int16'}
+    if 'GVA/H volume' in data.columns:
+        dtypes['GVA/H volume'] = 'float32'
+    return data.astype(dtypes)
+
+def available_levels(levels=LEVELS):
+    return [level for level, path in levels.items() if os.path.exists(path)]
+
+def artefact_path(path):
+    return os.path.splitext(path)[0] + '.parquet'
+
+def artefact_key(path):
+    return f'{file_hash(path)}:{ARTEFACT_FORMAT}'.encode()
+
+def build_artefact(path):
+    # Prepared and compacted ahead of time, e.g. while building the Docker image
+    table = pa.Table.from_pandas(compact(prepare(pd.read_csv(path))), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_HASH_KEY] = artefact_key(path)
+    pq.write_table(table.replace_schema_metadata(metadata), artefact_path(path))
+    return artefact_path(path)
+
+def load(path):
+    # Use the prebuilt artefact unless it is missing or was built from a different CSV
+    artefact = artefact_path(path)
+    if os.path.exists(artefact):
+        metadata = pq.read_schema(artefact).metadata or {}
+        if metadata.get(SOURCE_HASH_KEY) == artefact_key(path):
+            return pd.read_parquet(artefact)
+    return compact(prepare(pd.read_csv(path)))
+
+def spider_ranks(data, driver=DRIVER):
+    # Region x indicator table of each indicator's reference-year value
+    names = data['name'].unique().tolist()
+    values = pd.DataFrame(index=pd.Index(names, name='name'))
+    for indicator, years in driver.items():
+        sub = data.loc[data['year'] == int(years[1]), ['name', indicator]]
+        # float64 whatever the stored dtype, so the ranks and medians don't pick up any float32 rounding
+        values[indicator] = sub.set_index('name')[indicator].reindex(names).astype('float64')
+
+    # Percentile rank (0-100) of each region within each indicator
+    percentiles = values.rank(pct=True) * 100
+    for indicator in OPPOSITE_INDICATORS:
+        if indicator in percentiles.columns:
+            percentiles[indicator] = 100 - percentiles[indicator]
+
+    return {'values': values, 'percentiles': percentiles, 'medians': values.median()}
+
+def gauge_stats(data, driver=DRIVER):
+    # Reference-year median, max and default gauge bounds for each indicator, so gauges never scan the data
+    stats = {}
+    for indicator, (_, year, *_) in driver.items():
+        values = data.loc[data['year'] == int(year), indicator].astype('float64')
+        median = values.median()
+        # Calculate bounds as 2 standard deviations from the median (general bounds formula)
+        bounds = [median * 0.75, median * 1.25]
+        # Ensure indicators are not below 0 and encompass each class
+        bounds[0] = min(median * 0.85, max(0, bounds[0]))
+        bounds[1] = max(median * 1.15, bounds[1])
+        stats[indicator] = {'year': year, 'median': median, 'max': values.max(), 'bounds': bounds,
+                            'lower_is_better': indicator in OPPOSITE_INDICATORS}
+    return stats
+
+def region_index(data, columns=()):
+    # Rows are sorted by name (see prepare), so each region occupies one contiguous slice
+    names = data['name'].to_numpy()
+    starts = np.concatenate(([0], np.flatnonzero(names[1:] != names[:-1]) + 1))
+    stops = np.append(starts[1:], len(names))
+    if len(set(names[starts])) != len(starts):
+        raise ValueError('Rows must be grouped by region name to build a region index')
+
+    slices = {}
+    for start, stop in zip(starts, stops):
+        rows = slice(int(start), int(stop))
+        slices[names[start]] = rows
+        if 'code' in data.columns:
+            slices[data['code'].iat[start]] = rows
+
+    # Optional per-column arrays, so a region's history is a view rather than a copy
+    return {
+        'slices': slices,
+        'year': data['year'].to_numpy(),
+        'columns': {column: data[column].to_numpy() for column in columns},
+    }
+
+@timing.timed('data_prep.build_dataset')
+def build_dataset(data_path=DATA_PATH, uk_data_path=UK_DATA_PATH, driver=DRIVER):
+    # Everything the charts read, derived once per data version; callers must treat it as read-only
+    all_data = load(data_path)
+    regions = all_data.drop_duplicates('code')
+    ranks = spider_ranks(all_data, driver)
+    return {
+        'version': dataset_version(data_path, uk_data_path),
+        'all_data': all_data,
+        'uk_data': load(uk_data_path),
+        'codes': regions['code'].tolist(),
+        'names': regions['name'].tolist(),
+        'spider_ranks': ranks,
+        'peers': peers.build(ranks),
+        'gauge_stats': gauge_stats(all_data, driver),
+        'region_index': region_index(all_data, columns=list(driver) + ['GVA/H volume']),
+    }
+
+# Build the Parquet artefacts next to the CSVs, e.g. while building the Docker image
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*', default=[LEVELS[level] for level in available_levels()] + [UK_DATA_PATH])
+    args = parser.parse_args()
+    for path in args.paths:
+        print(build_artefact(path))
@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+import data_prep
+import timing
+
+'''
+The dataset the app serves, reloaded in the background when the CSVs change on disk.
+
+A poller checks the files' version (a stat each time, hashing only after a change) and, once a new
+version has stayed put for one interval, builds the new dataset on its own thread. Only a complete
+dataset is swapped in, by replacing one reference, so a rerun sees either the old dataset or the new
+one and never anything in between. Listeners are told about each swap, e.g. to drop cache entries keyed
+by the old version. If loading fails the old dataset stays in place and the next change is tried again.
+
+Partitions keeps one DataStore per geography level, loading each on first use and dropping it once it
+has gone unused for a while, so large levels such as LAD only take memory while someone is looking.
+Given a disk cache shared by several worker processes, a dataset one worker built for a data version is
+read back by the others instead of being built again.
+'''
+
+logger = logging.getLogger('itl3_compare.data')
+
+class DataStore:
+    def __init__(self, data_path=data_prep.DATA_PATH, uk_data_path=data_prep.UK_DATA_PATH, poll_seconds=30, disk=None):
+        self.data_path = data_path
+        self.uk_data_path = uk_data_path
+        self.poll_seconds = poll_seconds
+        self.disk = disk
+        self.reloads = 0
+        self.failures = 0
+        self._failed_version = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+        self._dataset = self._build()
+
+    def current(self):
+        # Hold on to the result for the whole run: it stays consistent even if a reload lands meanwhile
+        return self._dataset
+
+    def on_swap(self, listener):
+        # listener(old_version, new_version), called from the loading thread after each swap
+        self._listeners.append(listener)
+
+    def start(self):
+        if self.poll_seconds and self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name='itl3-data-store', daemon=True)
+            self._poller.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _version(self):
+        try:
+            return data_prep.dataset_version(self.data_path, self.uk_data_path)
+        except OSError:
+            # Mid-replace the file can briefly be missing; treat it as unsettled
+            return None
+
+    def _build(self):
+        # Read back from the disk cache when another worker already built this version
+        version = self._version() if self.disk is not None else None
+        if version is not None:
+            dataset = self.disk.get(('dataset', version))
+            if dataset is not None:
+                return dataset
+        dataset = data_prep.build_dataset(self.data_path, self.uk_data_path)
+        if version is not None and dataset['version'] == version:
+            self.disk.put(('dataset', version), dataset)
+        return dataset
+
+    def _poll(self):
+        seen = self._dataset['version']
+        while not self._stop.wait(self.poll_seconds):
+            version = self._version()
+            # Load once the new version has been seen twice in a row, so a file still being written is skipped
+            if version is not None and version == seen and version not in (self._dataset['version'], self._failed_version):
+                self.reload(version)
+            seen = version
+
+    def reload(self, expected=None):
+        # Builds the new dataset off to the side, and only swaps it in if the files didn't change meanwhile
+        with self._lock:
+            old = self._dataset
+            start = time.perf_counter()
+            before = self._version()
+            try:
+                dataset = self._build()
+            except Exception as e:
+                self.failures += 1
+                self._failed_version = before
+                timing.log_event(logger, 'data_reload', state='failed', error=f'{type(e).__name__}: {e}')
+                return False
+            if not before == dataset['version'] == self._version() or (expected is not None and before != expected):
+                timing.log_event(logger, 'data_reload', state='changed_while_loading', version=dataset['version'])
+                return False
+            if dataset['version'] == old['version']:
+                return False
+            self._dataset = dataset
+            self.reloads += 1
+            timing.log_event(logger, 'data_reload', state='swapped', old_version=old['version'],
+                             version=dataset['version'], ms=round((time.perf_counter() - start) * 1000, 3))
+        for listener in self._listeners:
+            listener(old['version'], dataset['version'])
+        return True
+
+class Partitions:
+    def __init__(self, levels=data_prep.LEVELS, uk_data_path=data_prep.UK_DATA_PATH, poll_seconds=30,
+                 idle_seconds=900, pinned=data_prep.DEFAULT_LEVEL, disk=None):
+        # The pinned level is never dropped, so the landing page stays warm
+        self.levels = {level: levels[level] for level in data_prep.available_levels(levels)}
+        self.uk_data_path = uk_data_path
+        self.poll_seconds = poll_seconds
+        self.idle_seconds = idle_seconds
+        self.pinned = pinned
+        self.disk = disk
+        self._stores = {}
+        self._last_used = {}
+        self._loading = {level: threading.Lock() for level in self.levels}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def on_swap(self, listener):
+        # listener(old_version, new_version) on every level's reloads, and with new_version None when a level is dropped
+        self._listeners.append(listener)
+
+    def get(self, level):
+        if level not in self.levels:
+            raise KeyError(f'No data for geography level {level}')
+        self._last_used[level] = time.monotonic()
+        store = self._stores.get(level)
+        if store is None:
+            # Loaded under the level's own lock, so a slow level doesn't hold up the others
+            with self._loading[level]:
+                store = self._stores.get(level)
+                if store is None:
+                    store = DataStore(self.levels[level], self.uk_data_path, self.poll_seconds, self.disk)
+                    for listener in self._listeners:
+                        store.on_swap(listener)
+                    with self._lock:
+                        self._stores[level] = store.start()
+                    timing.log_event(logger, 'partition_loaded', level=level, version=store.current()['version'])
+        self._drop_idle()
+        return store
+
+    def version(self, level):
+        # None once the level has been dropped
+        store = self._stores.get(level)
+        return store.current()['version'] if store is not None else None
+
+    def loaded(self):
+        return sorted(self._stores)
+
+    def _drop_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [level for level in self._stores
+                    if level != self.pinned and now - self._last_used.get(level, now) > self.idle_seconds]
+            dropped = [(level, self._stores.pop(level)) for level in idle]
+        for level, store in dropped:
+            store.stop()
+            version = store.current()['version']
+            timing.log_event(logger, 'partition_dropped', level=level, version=version)
+            for listener in self._listeners:
+                listener(version, None)
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import tempfile
+import time
+import timing
+
+'''
+A size-bounded cache on disk, shared by every worker process on a host (see serve.py).
+
+Each entry is one pickle file named by a hash of its key, so workers never need to coordinate. Writers
+save to a temporary file and rename it into place, which is atomic, so a reader sees a whole entry or
+none at all and concurrent writers of the same key simply leave one complete copy. Reading an entry
+touches its modification time, and once a worker has written a tenth of the budget it deletes the least
+recently used files until the cache is back under 90% of it.
+
+The directory outlives the code that filled it, so every key is qualified with a namespace, usually
+code_version() of the modules that build the cached values: after a deploy that changes them, the old
+entries are never read again and simply age out. Entries are unpickled, so a directory owned by another
+user, or writable by anyone else, is refused.
+'''
+
+logger = logging.getLogger('itl3_compare.disk_cache')
+
+# Bump whenever the layout of an entry changes
+CACHE_FORMAT = 1
+
+# Temporary files older than this were left by a writer that died mid-write
+PARTIAL_SECONDS = 3600
+
+def code_version(*modules):
+    # A hash of the cache format and each module's version, or its source for the app's own modules
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    for module in modules:
+        digest.update(module.__name__.encode())
+        version = getattr(module, '__version__', None)
+        if version is not None:
+            digest.update(str(version).encode())
+        else:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def check_private(directory):
+    # Anyone who can write here can make this process unpickle whatever they like
+    info = os.stat(directory)
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise PermissionError(f'Disk cache directory {directory} is owned by another user')
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f'Disk cache directory {directory} is writable by other users')
+
+class DiskCache:
+    def __init__(self, directory, max_bytes, namespace=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._written = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f'{digest}.pkl')
+
+    def get(self, key, default=None):
+        key = (self.namespace, key)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored, value = pickle.load(f)
+        except Exception:
+            # Missing, evicted by another worker meanwhile, or unreadable (e.g. pickled by an older version)
+            self.misses += 1
+            return default
+        if stored != key:
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        key = (self.namespace, key)
+        data = pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return value
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.partial')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(partial, path)
+            except BaseException:
+                os.unlink(partial)
+                raise
+        except OSError as e:
+            # e.g. a full disk: the cache is only an optimisation, so the caller keeps its value regardless
+            timing.log_event(logger, 'disk_cache', state='write_failed', directory=self.directory, error=str(e))
+            return value
+        self._written += len(data)
+        if self._written > self.max_bytes // 10:
+            self._written = 0
+            self.trim()
+        return value
+
+    def _files(self):
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for file in os.scandir(entry.path):
+                try:
+                    info = file.stat()
+                except FileNotFoundError:
+                    continue
+                if file.name.endswith('.pkl'):
+                    yield info.st_mtime, info.st_size, file.path
+                elif file.name.endswith('.partial') and now - info.st_mtime > PARTIAL_SECONDS:
+                    yield 0, info.st_size, file.path
+
+    def trim(self):
+        # Several workers may trim at once; each removes the oldest files, and one already gone is skipped
+        try:
+            self._trim()
+        except OSError as e:
+            timing.log_event(logger, 'disk_cache', state='trim_failed', directory=self.directory, error=str(e))
+
+    def _trim(self):
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        if size <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'directory': self.directory,
+            'namespace': self.namespace,
+            'max_size': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
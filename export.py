@@ -0,0 +1,187 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import plotly.offline
+import data_prep
+import payloads
+import visualisations
+import warmup
+
+'''
+Static export of the app's charts, e.g. as a fallback to serve under load or for reports.
+
+    python export.py -o export --formats png svg html --workers 8 [--pairs all | --pairs TLC31:TLC32,...]
+
+Writes the gauge and spider for every region to regions/<code>/, and with --pairs the time series and
+every bar chart for each pair to pairs/<code>_<code>/. Work is spread over a process pool, one region or
+pair per task, so each worker keeps its own Kaleido renderer warm. Files are written atomically and
+existing ones are skipped, so an interrupted export picks up where it left off. Per-worker timings go to
+export-timings.json in the output directory.
+'''
+
+FORMATS = ('png', 'svg', 'html')
+
+PLOTLY_JS = f'plotly-{plotly.offline.get_plotlyjs_version()}.min.js'
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+def parse_pairs(text, codes):
+    # 'all' for every unordered pair, otherwise comma-separated CODE:CODE as for ITL3_WARMUP_PAIRS
+    if text == 'all':
+        return list(itertools.combinations(codes, 2))
+    return warmup.parse_pairs(text)
+
+def bar_indicators(indicator):
+    # As the app's carousel: every indicator but the one on the gauges
+    return [bar for bar in data_prep.DRIVER if bar != indicator]
+
+def region_figures(dataset, code, indicator):
+    name = dataset['names'][dataset['codes'].index(code)]
+    return {'gauge': payloads.gauge(dataset, name, indicator), 'spider': payloads.spider(dataset, name, payloads.COLOURS[0])}
+
+def pair_figures(dataset, first, second, indicator):
+    names = dict(zip(dataset['codes'], dataset['names']))
+    regions = [names[first], names[second]]
+    figures = {'time-series': payloads.time_series(dataset, *regions)}
+    for bar in bar_indicators(indicator):
+        figures[f'bar-{slug(bar)}'] = visualisations.bar(
+            dataset['all_data'], bar, regions, data_prep.DRIVER[bar][0], index=dataset['region_index']
+        )
+    return figures
+
+def task_dir(output, task):
+    if task[0] == 'region':
+        return os.path.join(output, 'regions', task[1])
+    return os.path.join(output, 'pairs', f'{task[1]}_{task[2]}')
+
+def expected_files(output, task, formats, indicator):
+    # Known without building anything, so finished tasks can be skipped up front
+    if task[0] == 'region':
+        names = ['gauge', 'spider']
+    else:
+        names = ['time-series'] + [f'bar-{slug(bar)}' for bar in bar_indicators(indicator)]
+    directory = task_dir(output, task)
+    return [os.path.join(directory, f'{name}.{fmt}') for name in names for fmt in formats]
+
+def write(fig, path, fmt, plotly_js):
+    # Written under a temporary name and renamed, so a killed export never leaves a half-written file
+    partial = f'{path}.partial'
+    if fmt == 'html':
+        fig.write_html(partial, include_plotlyjs=plotly_js, full_html=True)
+    else:
+        fig.write_image(partial, format=fmt)
+    os.replace(partial, path)
+
+_dataset = None
+
+def _init_worker(data_path, uk_data_path):
+    global _dataset
+    _dataset = data_prep.build_dataset(data_path, uk_data_path)
+
+def _export(task, output, formats, indicator):
+    start = time.perf_counter()
+    if task[0] == 'region':
+        figures = region_figures(_dataset, task[1], indicator)
+    else:
+        figures = pair_figures(_dataset, task[1], task[2], indicator)
+    built = time.perf_counter()
+
+    directory = task_dir(output, task)
+    os.makedirs(directory, exist_ok=True)
+    # HTML pages share one copy of Plotly.js at the top of the output directory
+    plotly_js = os.path.relpath(os.path.join(output, PLOTLY_JS), directory).replace(os.sep, '/')
+    render_ms = dict.fromkeys(formats, 0.0)
+    written = 0
+    for name, fig in figures.items():
+        for fmt in formats:
+            path = os.path.join(directory, f'{name}.{fmt}')
+            if os.path.exists(path):
+                continue
+            begin = time.perf_counter()
+            write(fig, path, fmt, plotly_js)
+            render_ms[fmt] += (time.perf_counter() - begin) * 1000
+            written += 1
+    return {'pid': os.getpid(), 'build_ms': (built - start) * 1000, 'render_ms': render_ms, 'files': written}
+
+def summarise(results):
+    # Per worker totals, to spot a slow or idle worker
+    workers = {}
+    for result in results:
+        worker = workers.setdefault(result['pid'], {'tasks': 0, 'files': 0, 'build_ms': 0.0, 'render_ms': {}})
+        worker['tasks'] += 1
+        worker['files'] += result['files']
+        worker['build_ms'] += result['build_ms']
+        for fmt, ms in result['render_ms'].items():
+            worker['render_ms'][fmt] = worker['render_ms'].get(fmt, 0.0) + ms
+    for worker in workers.values():
+        worker['build_ms'] = round(worker['build_ms'], 1)
+        worker['render_ms'] = {fmt: round(ms, 1) for fmt, ms in worker['render_ms'].items()}
+        worker['busy_ms'] = round(worker['build_ms'] + sum(worker['render_ms'].values()), 1)
+    return {str(pid): worker for pid, worker in sorted(workers.items())}
+
+def export(output, formats=FORMATS, pairs=None, workers=None, indicator='GVA per hour worked', level=data_prep.DEFAULT_LEVEL):
+    output = os.path.abspath(output)
+    os.makedirs(output, exist_ok=True)
+    if 'html' in formats and not os.path.exists(os.path.join(output, PLOTLY_JS)):
+        with open(os.path.join(output, PLOTLY_JS), 'w', encoding='utf-8') as f:
+            f.write(plotly.offline.get_plotlyjs())
+
+    data_paths = (data_prep.LEVELS[level], data_prep.UK_DATA_PATH)
+    dataset = data_prep.build_dataset(*data_paths)
+    tasks = [('region', code) for code in dataset['codes']]
+    if pairs:
+        pairs = parse_pairs(pairs, dataset['codes'])
+        unknown = sorted({code for pair in pairs for code in pair} - set(dataset['codes']))
+        if unknown:
+            raise SystemExit(f"Unknown region codes: {', '.join(unknown)}")
+        tasks += [('pair', first, second) for first, second in pairs]
+    pending = [task for task in tasks if not all(os.path.exists(path) for path in expected_files(output, task, formats, indicator))]
+    print(f'{len(tasks) - len(pending)} of {len(tasks)} tasks already exported', file=sys.stderr)
+
+    start = time.perf_counter()
+    results, failed = [], []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=data_paths) as pool:
+        futures = {pool.submit(_export, task, output, formats, indicator): task for task in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failed.append({'task': list(futures[future]), 'error': f'{type(e).__name__}: {e}'})
+            if done % 50 == 0 or done == len(futures):
+                print(f'{done}/{len(futures)} tasks, {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    report = {
+        'level': level,
+        'version': dataset['version'],
+        'formats': list(formats),
+        'tasks': len(tasks),
+        'exported': len(results),
+        'skipped': len(tasks) - len(pending),
+        'failed': failed,
+        'files': sum(result['files'] for result in results),
+        'elapsed_s': round(time.perf_counter() - start, 3),
+        'workers': summarise(results),
+    }
+    with open(os.path.join(output, 'export-timings.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default='export')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--pairs', help="'all' for every pair of regions, or comma-separated CODE:CODE")
+    parser.add_argument('--workers', type=int, help='Worker processes (default one per CPU)')
+    parser.add_argument('--level', default=data_prep.DEFAULT_LEVEL, choices=data_prep.available_levels(), help='Geography level')
+    parser.add_argument('--indicator', default='GVA per hour worked', choices=list(data_prep.DRIVER), help='Gauge indicator')
+    args = parser.parse_args()
+    report = export(args.output, args.formats, args.pairs, args.workers, args.indicator, args.level)
+    print(json.dumps({key: value for key, value in report.items() if key != 'workers'}, indent=2))
+    if report['failed']:
+        sys.exit(1)
@@ -0,0 +1,45 @@
+import data_prep
+import visualisations
+import timing
+
+'''
+Cacheable chart payloads, shared by the app and the cache warm-up worker.
+
+A payload is described by a task tuple whose first item names the builder, e.g.
+('gauge', region, indicator). key() turns a task into its cache key and build() makes the
+payload from a dataset, so the app and the warm-up worker always agree on both.
+'''
+
+# Left and right region colours
+COLOURS = tuple(visualisations.REGION_COLOURS[:2])
+
+def gauge(dataset, region, indicator):
+    # Reference year, bounds and median come precomputed with the dataset
+    stats = dataset['gauge_stats'][indicator]
+    return visualisations.gauge(dataset['all_data'], region, indicator, stats['year'], stats['bounds'], index=dataset['region_index'], stats=stats)
+
+def spider(dataset, region, colour):
+    # Covers every indicator, so it doesn't change with the headline indicator
+    return visualisations.spider(dataset['spider_ranks'], region, colour)
+
+def time_series(dataset, *regions):
+    return visualisations.time_series(dataset['all_data'], list(regions), dataset['uk_data'], index=dataset['region_index'])
+
+def bar_html(dataset, indicator, *regions):
+    # Region order matters: it decides the bar colours and the title
+    bar = visualisations.bar(dataset['all_data'], indicator, list(regions), data_prep.DRIVER[indicator][0], index=dataset['region_index'])
+    with timing.span('bar.to_html'):
+        return bar.to_html(full_html=False, include_plotlyjs=False)
+
+BUILDERS = {
+    'gauge': gauge,
+    'spider': spider,
+    'time_series': time_series,
+    'bar_html': bar_html,
+}
+
+def key(version, task):
+    return (version, *task)
+
+def build(dataset, task):
+    return BUILDERS[task[0]](dataset, *task[1:])
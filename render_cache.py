@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+
+'''Bounded in-process caches for rendered chart output, shared by every session'''
+
+class LRUCache:
+    def __init__(self, max_size, sizeof=len, backing=None):
+        # Entries are weighed with sizeof, e.g. len for strings or a constant 1 to bound the entry count.
+        # backing, e.g. a disk_cache.DiskCache, is shared with other processes: entries put here are
+        # written through to it, and misses are looked up there before being built
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.backing = backing
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        if self.backing is not None:
+            self.backing.put(key, value)
+        return self._remember(key, value)
+
+    def _remember(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            # Anything bigger than the whole budget is never worth keeping
+            if size > self.max_size:
+                return value
+            self._entries[key] = (value, size)
+            self.size += size
+            # Evict least recently used entries until back under budget
+            while self.size > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, create):
+        # Built outside the lock, so two sessions missing together may both render once
+        value = self.get(key, _MISSING)
+        if value is _MISSING and self.backing is not None:
+            value = self.backing.get(key, _MISSING)
+            if value is not _MISSING:
+                return self._remember(key, value)
+        if value is _MISSING:
+            value = self.put(key, create())
+        return value
+
+    def evict(self, predicate):
+        # Drops every entry whose key matches, e.g. those built from an old dataset version
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.size -= self._entries.pop(key)[1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+_MISSING = object()
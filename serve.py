@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import tornado.httpclient
+import tornado.httputil
+import tornado.web
+import tornado.websocket
+import settings
+import timing
+
+'''
+Multi-worker mode: several app processes behind one sticky proxy, so throughput isn't capped by one GIL.
+
+    python serve.py --workers 4 [--port 80]
+
+Each worker is a plain `streamlit run` on its own local port. A Streamlit session lives in the process
+that created it, so the proxy keeps each browser on one worker: new visitors go to the worker with the
+fewest open sessions and are pinned to it with a cookie, which the websocket carries too. Workers share
+a disk cache of loaded datasets and carousel charts (ITL3_DISK_CACHE_DIR, by default a private temporary
+directory removed on exit), so whatever one worker builds the others read back. A worker that exits is restarted, and
+visitors pinned to it move to another until it is back. With one worker this just runs `streamlit run`.
+With ITL3_WARMUP on, each worker's cache warm-up is started once it is up (see warmup.py). With
+ITL3_API_PORT set, the JSON API runs in a process of its own (see api.py), so it listens from startup
+whether or not anyone has opened the app.
+'''
+
+logger = logging.getLogger('itl3_compare.serve')
+
+APP = 'Streamlit_itl3-compare.py'
+
+# Cookie pinning a browser to its worker
+COOKIE = 'itl3_worker'
+
+# Seconds between checks that each worker is up
+CHECK_SECONDS = 2
+
+# Upstream requests in flight at once per worker; more wait in the proxy's queue
+CLIENTS_PER_WORKER = 32
+
+# Largest websocket message relayed, as Streamlit's own default server.maxMessageSize
+MAX_MESSAGE_BYTES = 200 * 1024 * 1024
+
+# Request headers that only make sense for one hop
+HOP_HEADERS = {'Connection', 'Keep-Alive', 'Transfer-Encoding', 'Upgrade', 'Content-Length', 'Te', 'Trailer'}
+
+class Worker:
+    def __init__(self, index, port, env):
+        self.index = index
+        self.port = port
+        self.env = env
+        self.process = None
+        self.ready = False
+        self.sessions = 0
+        self.warming = None
+
+    def start(self):
+        self.ready = False
+        self.process = subprocess.Popen([sys.executable, '-m', 'streamlit', 'run', APP, '--server.port', str(self.port),
+                                         '--server.address', '127.0.0.1', '--server.headless', 'true'], env=self.env)
+        timing.log_event(logger, 'worker', state='started', worker=self.index, port=self.port, pid=self.process.pid)
+
+    def stop(self):
+        for process in (self.process, self.warming):
+            if process is not None and process.poll() is None:
+                process.terminate()
+
+    def warm(self):
+        # Opens one session on this worker, so its caches start warming before anyone visits
+        self.warming = warmup_trigger(f'http://127.0.0.1:{self.port}')
+
+    async def check(self, client):
+        if self.warming is not None and self.warming.poll() is not None:
+            self.warming = None
+        if self.process.poll() is not None:
+            timing.log_event(logger, 'worker', state='exited', worker=self.index, code=self.process.returncode)
+            self.start()
+            return
+        if not self.ready:
+            try:
+                response = await client.fetch(f'http://127.0.0.1:{self.port}/_stcore/health', raise_error=False)
+            except OSError:
+                # Still starting up
+                return
+            self.ready = response.code == 200
+            if self.ready:
+                timing.log_event(logger, 'worker', state='ready', worker=self.index)
+                if settings.WARMUP:
+                    self.warm()
+
+class ApiServer:
+    def __init__(self, port, env):
+        self.port = port
+        self.env = env
+        self.process = None
+
+    def start(self):
+        self.process = start_api(self.port, self.env)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    async def check(self, client):
+        if self.process.poll() is not None:
+            timing.log_event(logger, 'api', state='exited', code=self.process.returncode)
+            self.start()
+
+class Pool:
+    def __init__(self, workers, services=()):
+        # services, such as the ApiServer, are restarted like workers but never sent visitors
+        self.workers = workers
+        self.services = list(services)
+
+    def pick(self, pinned):
+        # The browser's own worker while it is up, otherwise the ready worker with the fewest sessions
+        ready = [worker for worker in self.workers if worker.ready]
+        for worker in ready:
+            if str(worker.index) == pinned:
+                return worker
+        return min(ready, key=lambda worker: worker.sessions, default=None)
+
+    async def supervise(self):
+        # A client of its own, so health checks never queue behind proxied requests
+        client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        while True:
+            for process in self.workers + self.services:
+                await process.check(client)
+            await asyncio.sleep(CHECK_SECONDS)
+
+class ProxyHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+    def initialize(self, pool):
+        self.pool = pool
+
+    def compute_etag(self):
+        # Left to the worker
+        return None
+
+    async def forward(self, *args):
+        headers = tornado.httputil.HTTPHeaders()
+        for name, value in self.request.headers.get_all():
+            if name not in HOP_HEADERS:
+                headers.add(name, value)
+        body = self.request.body if self.request.method in ('POST', 'PUT', 'PATCH') else None
+        while True:
+            worker = self.pool.pick(self.get_cookie(COOKIE))
+            if worker is None:
+                raise tornado.web.HTTPError(503, reason='No workers ready')
+            try:
+                response = await tornado.httpclient.AsyncHTTPClient().fetch(
+                    f'http://127.0.0.1:{worker.port}{self.request.uri}', method=self.request.method, headers=headers, body=body,
+                    allow_nonstandard_methods=True, follow_redirects=False, decompress_response=False, raise_error=False,
+                )
+                break
+            except (OSError, tornado.httpclient.HTTPClientError):
+                # Exited since the last check, or timed out: try another while the health checks catch up
+                worker.ready = False
+
+        self.set_status(response.code, response.reason)
+        # The worker's own headers replace the proxy's defaults, such as Server, Date and Content-Type
+        for name in set(response.headers):
+            self.clear_header(name)
+        for name, value in response.headers.get_all():
+            if name not in HOP_HEADERS:
+                self.add_header(name, value)
+        if self.get_cookie(COOKIE) != str(worker.index):
+            self.set_cookie(COOKIE, str(worker.index), httponly=True, samesite='Lax')
+        if response.body and response.code not in (204, 304):
+            self.write(response.body)
+
+    get = head = post = put = patch = delete = options = forward
+
+class StreamHandler(tornado.websocket.WebSocketHandler):
+    # The session's websocket, relayed message by message to and from the browser's worker
+    def initialize(self, pool):
+        self.pool = pool
+        self.worker = None
+        self.upstream = None
+
+    def check_origin(self, origin):
+        # Left to the worker, which sees the browser's Origin and Host headers
+        return True
+
+    def select_subprotocol(self, subprotocols):
+        # Streamlit's first subprotocol is always "streamlit"; the others carry session details
+        return subprotocols[0] if subprotocols else None
+
+    async def open(self, *args):
+        self.worker = self.pool.pick(self.get_cookie(COOKIE))
+        if self.worker is None:
+            self.close(1013, 'No workers ready')
+            return
+        headers = {name: value for name, value in self.request.headers.get_all()
+                   if name in ('Host', 'Origin', 'Cookie', 'User-Agent', 'X-Forwarded-For')}
+        protocols = [protocol.strip() for protocol in self.request.headers.get('Sec-WebSocket-Protocol', '').split(',') if protocol.strip()]
+        request = tornado.httpclient.HTTPRequest(f'ws://127.0.0.1:{self.worker.port}{self.request.uri}', headers=headers)
+        try:
+            self.upstream = await tornado.websocket.websocket_connect(request, subprotocols=protocols or None,
+                                                                   max_message_size=MAX_MESSAGE_BYTES)
+        except Exception as e:
+            timing.log_event(logger, 'proxy', state='connect_failed', worker=self.worker.index, error=f'{type(e).__name__}: {e}')
+            self.close(1011, 'Worker unavailable')
+            return
+        self.worker.sessions += 1
+        asyncio.ensure_future(self.relay())
+
+    async def relay(self):
+        # on_close() clears self.upstream, so keep hold of this session's connection
+        upstream = self.upstream
+        while True:
+            message = await upstream.read_message()
+            if message is None:
+                self.close()
+                return
+            try:
+                await self.write_message(message, binary=isinstance(message, bytes))
+            except tornado.websocket.WebSocketClosedError:
+                return
+
+    async def on_message(self, message):
+        if self.upstream is not None:
+            await self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+            self.upstream = None
+            self.worker.sessions -= 1
+
+def warmup_trigger(url, wait=0):
+    # A separate process, so the proxy never imports Streamlit's protobufs or waits on a page run
+    return subprocess.Popen([sys.executable, 'warmup.py', '--url', url, '--wait', str(wait)])
+
+def start_api(port, env=None):
+    process = subprocess.Popen([sys.executable, 'api.py', '--port', str(port), '--exit-with-parent'], env=env)
+    timing.log_event(logger, 'api', state='started', port=port, pid=process.pid)
+    return process
+
+def main(workers, port, worker_port):
+    if workers <= 1:
+        if settings.API_PORT:
+            start_api(settings.API_PORT)
+        if settings.WARMUP:
+            # Waits for the server this process is about to become
+            warmup_trigger(f'http://127.0.0.1:{port}', wait=300)
+        os.execvp(sys.executable, [sys.executable, '-m', 'streamlit', 'run', APP, '--server.port', str(port)])
+
+    env = dict(os.environ)
+    # A fresh directory only this user can open, as the workers unpickle what they find there
+    private_cache = None
+    if 'ITL3_DISK_CACHE_DIR' not in env:
+        private_cache = env['ITL3_DISK_CACHE_DIR'] = tempfile.mkdtemp(prefix='itl3-compare-cache-')
+    # One secret for all workers, so cookies signed by one are accepted by the others
+    env.setdefault('STREAMLIT_SERVER_COOKIE_SECRET', secrets.token_hex(32))
+    services = [ApiServer(settings.API_PORT, env)] if settings.API_PORT else []
+    # Tornado's default client allows only 10 requests in flight, which would cap every worker together
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=workers * CLIENTS_PER_WORKER)
+    pool = Pool([Worker(index, worker_port + index, env) for index in range(workers)], services)
+
+    async def run():
+        app = tornado.web.Application([
+            (r'/(?:.*/)?_stcore/stream', StreamHandler, {'pool': pool}),
+            (r'.*', ProxyHandler, {'pool': pool}),
+        ], websocket_max_message_size=MAX_MESSAGE_BYTES)
+        app.listen(port)
+        for process in pool.workers + pool.services:
+            process.start()
+        timing.log_event(logger, 'proxy', state='listening', port=port, workers=workers)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        supervisor = asyncio.ensure_future(pool.supervise())
+        await stop.wait()
+        supervisor.cancel()
+
+    try:
+        asyncio.run(run())
+    finally:
+        for process in pool.workers + pool.services:
+            process.stop()
+        if private_cache is not None:
+            # Once the workers have exited, so none is still writing to it
+            for worker in pool.workers:
+                if worker.process is not None:
+                    try:
+                        worker.process.wait(10)
+                    except subprocess.TimeoutExpired:
+                        pass
+            shutil.rmtree(private_cache, ignore_errors=True)
+
+if __name__ == '__main__':
+    from streamlit import config
+
+    parser = argparse.ArgumentParser(description='Run several app processes behind a sticky proxy')
+    parser.add_argument('--workers', type=int, default=settings.WORKERS, help='App processes (default ITL3_WORKERS)')
+    parser.add_argument('--port', type=int, default=config.get_option('server.port'), help="Public port (default Streamlit's server.port)")
+    parser.add_argument('--worker-port', type=int, default=8600, help='Port of the first worker; the others follow on')
+    args = parser.parse_args()
+    main(args.workers, args.port, args.worker_port)
@@ -0,0 +1,49 @@
+import os
+
+'''Deployment options, read from environment variables so they can be set in compose.yml or docker run'''
+
+# 'eager' sends every bar chart in one Bootstrap carousel, 'lazy' builds only the slide being viewed
+CAROUSEL_MODE = os.environ.get('ITL3_CAROUSEL_MODE', 'eager').lower()
+
+# Budget for cached carousel bar chart HTML, shared across sessions
+BAR_HTML_CACHE_BYTES = int(os.environ.get('ITL3_BAR_CACHE_MB', '64')) * 1024 * 1024
+
+# Number of figures (per-region gauges and spiders, and time series for each set of compared regions) kept
+# in memory, shared across sessions
+FIGURE_CACHE_ENTRIES = int(os.environ.get('ITL3_FIGURE_CACHE_ENTRIES', '1024'))
+
+# Serve Plotly.js and Bootstrap from static/vendor (built by assets.py) rather than public CDNs
+SELF_HOSTED_ASSETS = os.environ.get('ITL3_SELF_HOSTED_ASSETS', '').lower() in ('1', 'true', 'yes')
+
+# Play the gauge, spider and time series animations (rendered client-side by Plotly.js)
+ANIMATE = os.environ.get('ITL3_ANIMATE', '').lower() in ('1', 'true', 'yes')
+
+# Record timing spans for every rerun, log them as JSON lines and show the debug panel (or use ?debug=timing)
+TIMING = os.environ.get('ITL3_TIMING', '').lower() in ('1', 'true', 'yes')
+
+# Warm the chart caches in the background when the app first runs (see warmup.py)
+WARMUP = os.environ.get('ITL3_WARMUP', '').lower() in ('1', 'true', 'yes')
+
+# Worker processes for the warm-up; 0 builds on a background thread in the server process instead
+WARMUP_WORKERS = int(os.environ.get('ITL3_WARMUP_WORKERS', '0'))
+
+# Popular region pairs to warm after the landing page, as comma-separated CODE:CODE, e.g. TLC31:TLC32
+WARMUP_PAIRS = os.environ.get('ITL3_WARMUP_PAIRS', '')
+
+# Seconds between checks for changed data files, which are then reloaded in the background; 0 disables reloading
+DATA_POLL_SECONDS = float(os.environ.get('ITL3_DATA_POLL_SECONDS', '30'))
+
+# Seconds a geography level's data can go unused before it is dropped from memory (the default ITL3 level is kept)
+PARTITION_IDLE_SECONDS = float(os.environ.get('ITL3_PARTITION_IDLE_SECONDS', '900'))
+
+# Port for the read-only JSON API (see api.py), run by serve.py in a process of its own; 0 leaves it off
+API_PORT = int(os.environ.get('ITL3_API_PORT', '0'))
+
+# App processes started by serve.py behind its sticky proxy; 1 runs a single `streamlit run`
+WORKERS = int(os.environ.get('ITL3_WORKERS', '1'))
+
+# Directory for the disk cache shared by the worker processes (see disk_cache.py); empty leaves it off
+DISK_CACHE_DIR = os.environ.get('ITL3_DISK_CACHE_DIR', '')
+
+# Budget for the shared disk cache
+DISK_CACHE_BYTES = int(os.environ.get('ITL3_DISK_CACHE_MB', '512')) * 1024 * 1024
@@ -0,0 +1,114 @@
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+'''
+Timing spans around the rerun hot path.
+
+Each script or fragment run is recorded with rerun(); span() and @timed add named, nested timings to it.
+Finished reruns are logged as one JSON line and folded into rolling per-process aggregates. When a run
+isn't being recorded span() hands back a shared no-op context, so the disabled cost is one attribute lookup.
+'''
+
+# Samples kept per span name for the rolling aggregates
+ROLLING_WINDOW = 1000
+
+logger = logging.getLogger('itl3_compare.timing')
+
+_local = threading.local()
+_disabled = nullcontext()
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+class _Span:
+    __slots__ = ('name', 'record', 'entry', 'start')
+
+    def __init__(self, name, record):
+        self.name = name
+        self.record = record
+
+    def __enter__(self):
+        # Entered in start order, so nested spans follow their parent
+        self.entry = {'name': self.name, 'ms': None, 'depth': self.record['depth']}
+        self.record['spans'].append(self.entry)
+        self.record['depth'] += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ms = (time.perf_counter() - self.start) * 1000
+        self.record['depth'] -= 1
+        self.entry['ms'] = round(ms, 3)
+        _aggregate(self.name, ms)
+        return False
+
+def span(name):
+    record = getattr(_local, 'record', None)
+    if record is None or not record['enabled']:
+        return _disabled
+    return _Span(name, record)
+
+def timed(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextmanager
+def rerun(enabled, **fields):
+    # Yields the record to whoever started it; a nested call (a fragment inside a full run) joins it and gets None
+    if getattr(_local, 'record', None) is not None:
+        yield None
+        return
+    record = {'enabled': enabled, 'spans': [], 'depth': 0, **fields}
+    _local.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _local.record = None
+        if enabled:
+            record['total_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            _aggregate('rerun', record['total_ms'])
+            _log(record)
+
+def _aggregate(name, ms):
+    with _aggregates_lock:
+        if name not in _aggregates:
+            _aggregates[name] = deque(maxlen=ROLLING_WINDOW)
+        _aggregates[name].append(ms)
+
+def aggregates():
+    with _aggregates_lock:
+        samples = {name: sorted(values) for name, values in _aggregates.items()}
+    return {
+        name: {
+            'count': len(values),
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p50_ms': round(values[len(values) // 2], 3),
+            'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        }
+        for name, values in samples.items()
+    }
+
+def log_event(log, event, **fields):
+    # One JSON line per event on stderr
+    if not log.handlers:
+        # Streamlit only configures its own loggers, so give ours a plain JSON-lines handler
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+    log.info(json.dumps({'event': event, **fields}))
+
+def _log(record):
+    log_event(logger, 'rerun', **{key: value for key, value in record.items() if key not in ('enabled', 'depth')})
@@ -1,79 +1,143 @@
+import functools
 import plotly.graph_objects as go
+import plotly.colors
+import plotly.io as pio
 import textwrap
-import pandas as pd
+import numpy as np
+import timing
 
 '''Data should only be filtered by indicator and ITL1 regions'''
 
-def gauge(data, region, indicator, selected_year, bounds, fontsize=36):
-    data = data.loc[data['year'] == int(selected_year), :]
-    median = data[indicator].median()
-    temp = data.loc[(data['name'] == region), :]
-    value = temp[indicator].values[0]
+# One colour per compared region, the first two matching the gauges and spiders on either side
+REGION_COLOURS = ['#eb5e5e', '#9c4f8b'] + plotly.colors.qualitative.Dark24
+
+# Indicators measured in pounds; the rest are shares, stored as fractions
+MONEY_INDICATORS = ['GVA per hour worked', 'GFCF per job', 'ICT per job', 'Intangibles per job']
+
+def _region_rows(data, region, index=None):
+    # index comes from data_prep.region_index and must be built from the same row order as data
+    if index is None:
+        return data.loc[data['name'] == region, :]
+    return data.iloc[index['slices'][region]]
+
+def _region_series(data, region, column, index=None):
+    # Years and non-missing values of one column for one region
+    if index is not None and column in index['columns']:
+        rows = index['slices'][region]
+        years, values = index['year'][rows], index['columns'][column][rows]
+        keep = ~np.isnan(values)
+        return years[keep], values[keep]
+    temp = _region_rows(data, region, index)[['year', column]].dropna()
+    return temp['year'], temp[column]
+
+def _regions_series(data, regions, column, index=None):
+    # _region_series for several regions, filtering and splitting the data once rather than per region
+    if index is not None and column in index['columns']:
+        return [_region_series(data, region, column, index) for region in regions]
+    temp = data.loc[data['name'].isin(regions), ['name', 'year', column]].dropna()
+    groups = {name: group for name, group in temp.groupby('name', observed=True, sort=False)}
+    empty = temp.iloc[:0]
+    return [(groups.get(region, empty)['year'], groups.get(region, empty)[column]) for region in regions]
+
+def _regions_title(regions):
+    if len(regions) == 2:
+        return f"{regions[0]} against {regions[1]}"
+    if len(regions) <= 4:
+        return ', '.join(regions[:-1]) + f" and {regions[-1]}"
+    return f"{len(regions)} regions"
+
+@functools.lru_cache(maxsize=None)
+def _template(name):
+    # Expanded once; Plotly would otherwise look up and validate the whole template for every figure
+    return pio.templates[name].to_plotly_json()
+
+def _figure(data, layout):
+    # Figures are written as plain dicts in the form Plotly's validators would leave them in, so they are
+    # built without validating every property again. Check a changed spec with go.Figure(spec) first
+    return go.Figure({'data': data, 'layout': layout}, _validate=False)
+
+def _title(text, width):
+    return '<br>'.join(textwrap.wrap(text, width=width))
+
+@timing.timed('visualisations.gauge')
+def gauge(data, region, indicator, selected_year, bounds, fontsize=36, index=None, stats=None):
+    # stats comes from data_prep.gauge_stats and saves scanning the whole year for the median and max
+    bounds = list(bounds)  # Widened below for this region only
+    if index is not None and indicator in index['columns']:
+        rows = index['slices'][region]
+        values = index['columns'][indicator][rows][index['year'][rows] == int(selected_year)]
+    else:
+        temp = _region_rows(data, region, index)
+        values = temp.loc[temp['year'] == int(selected_year), indicator].values
+    # Missing for this region and year leaves the gauge empty
+    value = values[0] if len(values) else np.nan
+    if stats is None:
+        data = data.loc[data['year'] == int(selected_year), :]
+        stats = {'median': data[indicator].median(), 'max': data[indicator].max()}
+    median = stats['median']
+    # Below the median is good news for indicators such as Low Skilled, so the colours swap round
+    low, high = ("#00979e", "#eb5f5f") if stats.get('lower_is_better') else ("#eb5f5f", "#00979e")
     if value * 1.15 > bounds[1]:
         bounds[1] = value * 1.15
-    fig = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=value,
-        title={'text': '<br>'.join(textwrap.wrap(f"{region} {indicator}, {selected_year}", width=40)),
-            'font': {'size': 16}},
-        number={'font': {'size': fontsize},
-                'prefix': "£"},  # Adjust the number text size
-        gauge={
-            'axis': {'range': [bounds[0], bounds[1]]},  # Adjust range as needed
-            'bar': {'color': "rgba(10, 10, 10, 0.6)"},  # Set bar color with 50% transparency
-            'steps': [
-                {'range': [bounds[0], median * 0.95], 'color': "#eb5f5f"},
-                {'range': [median * 0.95, median * 1.05], 'color': "#fcbf0b"},
-                {'range': [median * 1.05, data[indicator].max() * 1.2], 'color': "#00979e"}
-            ],
-        },
-        domain={'x': [0.2, 0.8]}  # shrink gauge within figure
-    ))
-    fig.update_layout(
-        autosize=True,
-        height=290
+    # Ranges as Python floats, as Plotly's validator would convert them
+    axis = {'range': [float(bounds[0]), float(bounds[1])]}  # Adjust range as needed
+    if indicator in MONEY_INDICATORS:
+        number = {'font': {'size': fontsize}, 'prefix': "£"}  # Adjust the number text size
+    else:
+        number = {'font': {'size': fontsize}, 'valueformat': '.1%'}
+        axis['tickformat'] = '.0%'
+    return _figure(
+        [{
+            'type': 'indicator',
+            'mode': "gauge+number",
+            'value': value,
+            'title': {'text': _title(f"{region} {indicator}, {selected_year}", 40), 'font': {'size': 16}},
+            'number': number,
+            'gauge': {
+                'axis': axis,
+                'bar': {'color': "rgba(10, 10, 10, 0.6)"},  # Set bar color with 50% transparency
+                'steps': [
+                    {'range': [float(bounds[0]), float(median * 0.95)], 'color': low},
+                    {'range': [float(median * 0.95), float(median * 1.05)], 'color': "#fcbf0b"},
+                    {'range': [float(median * 1.05), float(stats['max'] * 1.2)], 'color': high}
+                ],
+            },
+            'domain': {'x': [0.2, 0.8]}  # shrink gauge within figure
+        }],
+        {'autosize': True, 'height': 290, 'template': _template(pio.templates.default)}
     )
-    return fig
 
-def time_series(data, regions, uk_data):
+@timing.timed('visualisations.time_series')
+def time_series(data, regions, uk_data, index=None):
     uk_data = uk_data[['name', 'year', 'GVA/H volume']].dropna()
-    data = data[['name', 'year', 'GVA/H volume']].dropna()
-    
-    temp = data.loc[(data['name'] == regions[0]), :]
 
-    # Create a time series plot
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=uk_data['year'],  # X-axis: Year
-        y=uk_data['GVA/H volume'],  # Y-axis: Indicator values
-        mode='lines',  # Line and markers
-        name=f"United Kingdom",
-        line=dict(color="rgba(85, 85, 85, 0.3)", width=2),  # Customize line color and width
-        marker=dict(size=6),  # Customize marker size
-    ))
-    fig.add_trace(go.Scatter(
-        x=temp['year'],  # X-axis: Year
-        y=temp['GVA/H volume'],  # Y-axis: Indicator values
-        mode='lines+markers',  # Line and markers
-        name=f"{regions[0]}",
-        line=dict(color="#eb5e5e", width=2),  # Customize line color and width
-        marker=dict(size=6)  # Customize marker size
-    ))
-    temp = data.loc[(data['name'] == regions[1]), :]
-    fig.add_trace(go.Scatter(
-        x=temp['year'],  # X-axis: Year
-        y=temp['GVA/H volume'],  # Y-axis: Indicator values
-        mode='lines+markers',  # Line and markers
-        name=f"{regions[1]}",
-        line=dict(color="#9c4f8b", width=2),  # Customize line color and width
-        marker=dict(size=6)  # Customize marker size
-    ))
+    # Create a time series plot: the UK, then one line per region
+    traces = [{
+        'type': 'scatter',
+        'x': uk_data['year'].to_numpy(),  # X-axis: Year
+        'y': uk_data['GVA/H volume'].to_numpy(),  # Y-axis: Indicator values
+        'mode': 'lines',  # Line and markers
+        'name': "United Kingdom",
+        'line': {'color': "rgba(85, 85, 85, 0.3)", 'width': 2},  # Customize line color and width
+        'marker': {'size': 6},  # Customize marker size
+    }]
+    traces += [
+        {
+            'type': 'scatter',
+            'x': np.asarray(years),  # X-axis: Year
+            'y': np.asarray(values),  # Y-axis: Indicator values
+            'mode': 'lines+markers',  # Line and markers
+            'name': f"{region}",
+            'line': {'color': colour, 'width': 2},  # Customize line color and width
+            'marker': {'size': 6}  # Customize marker size
+        }
+        for region, colour, (years, values) in zip(regions, REGION_COLOURS, _regions_series(data, regions, 'GVA/H volume', index))
+    ]
 
-    # Update layout for better visualization
-    fig.update_layout(
-        title={
-            'text': '<span style="font-weight:normal;">' + 
-            '<br>'.join(textwrap.wrap(f"Time Series of {regions[0]} against {regions[1]} - <b>GVA per hour (chained 2008)</b>", width=100)) +
+    return _figure(traces, {
+        'title': {
+            'text': '<span style="font-weight:normal;">' +
+            _title(f"Time Series of {_regions_title(regions)} - <b>GVA per hour (chained 2008)</b>", 100) +
             '</span>',
             'font': {'size': 14},
             'x': 0.05,  # move slightly to the right (0=left, 1=right)
@@ -81,77 +145,44 @@ def time_series(data, regions, uk_data):
             'xanchor': 'left',   # align title relative to x
             'yanchor': 'top',    # align title relative to y
         },
-        xaxis_title="Year",
-        yaxis_title=f"GVA per hour (chained 2008) (%)",
-        autosize=True,
-        template="plotly_white",  # Use a clean white background
-        legend=dict(
-            orientation="h",  # Horizontal legend
-            y=-0.3,  # Position below the chart
-            x=-0.02,  # Center the legend horizontally
-            xanchor="left",  # Anchor the legend
-            font=dict(size=16)
-        ),
-        height=350
-    )
-    
-    return fig
-
-def spider(data, indicators, region, colour, driver):
-    # Build the output DataFrame
-    row = pd.DataFrame({'name': data['name'].unique()})
-    for indicator, years in driver.items():
-        # Get the year for this period
-        year_val = int(years[1])
-        # Subset data for this year and column
-        sub = data.loc[data['year'] == year_val, ['name', indicator]]
-        # Merge so values align by code
-        row = row.merge(sub, on='name', how='left')
-    
-    # Compute percentile ranks for each indicator
-    percentile_ranks = pd.DataFrame({'name': data['name'].unique()})
-
-    for ind in indicators:
-        # For each indicator, get the series
-        series = row[ind]
-
-        # Compute percentile rank of each value
-        ranks = series.rank(pct=True) * 100  # gives 0–100
-        percentile_ranks[ind] = ranks
+        'xaxis': {'title': {'text': "Year"}},
+        'yaxis': {'title': {'text': "GVA per hour (chained 2008) (%)"}},
+        'autosize': True,
+        'template': _template("plotly_white"),  # Use a clean white background
+        'legend': {
+            'orientation': "h",  # Horizontal legend
+            'y': -0.3,  # Position below the chart
+            'x': -0.02,  # Center the legend horizontally
+            'xanchor': "left",  # Anchor the legend
+            'font': {'size': 16}
+        },
+        'height': 350
+    })
 
-    # Subset to your region of interest
-    temp = percentile_ranks.loc[percentile_ranks['name'] == region, indicators].copy()
+@timing.timed('visualisations.spider')
+def spider(ranks, region, colour):
+    # ranks comes from data_prep.spider_ranks, so this only reads the region's row
+    temp = ranks['percentiles'].loc[region]
+    real_values = ranks['values'].loc[region]
+    medians = ranks['medians']
 
-    # Handle "opposite indicators" (lower values = better)
-    opposite_indicators = ['Low Skilled', 'Inactive due to Illness']
-    for ind in opposite_indicators:
-        if ind in temp.columns:
-            temp[ind] = 100 - temp[ind]  # invert percentile so "lower = better"
     # Handle missing data by filtering out NaN values
-    temp = temp.dropna(axis=1)  # Drop columns with NaN values
-    # Compute real values for the region
-    real_values = row.loc[row['name'] == region, indicators].copy()
-
-    # Compute medians for each indicator 
-    medians = row[indicators].median()
-
-    # Handle missing values consistently
-    valid_indicators = [ind for ind in indicators if ind in temp.columns]
+    valid_indicators = temp.dropna().index.tolist()
 
     # Close the loop
-    r_values = temp[valid_indicators].values.flatten().tolist()
+    r_values = temp[valid_indicators].tolist()
     r_values.append(r_values[0])
 
-    theta_values = ['<br>'.join(textwrap.wrap(ind, width=10)) for ind in valid_indicators]
+    theta_values = [_title(ind, 10) for ind in valid_indicators]
     theta_values.append(theta_values[0])
 
     # Build custom hover text
     hover_texts = []
     for ind in valid_indicators:
-        raw_val = real_values[ind].values[0]
+        raw_val = real_values[ind]
         median_val = medians[ind]
-        percentile_val = temp[ind].values[0]
-        if ind in ['GVA per hour worked', 'GFCF per job', 'ICT per job', 'Intangibles per job']:
+        percentile_val = temp[ind]
+        if ind in MONEY_INDICATORS:
             hover_texts.append(
                 f"<b>Indicator:</b> {ind}<br>"
                 f"<b>Value:</b> £{raw_val:,.2f}<br>"
@@ -169,92 +200,84 @@ def spider(data, indicators, region, colour, driver):
     hover_texts.append(hover_texts[0])
 
     # Create the figure
-    fig = go.Figure()
-    fig.add_trace(go.Scatterpolar(
-        r=r_values,
-        theta=theta_values,
-        text=hover_texts,         # supply custom hover text
-        hoverinfo="text",         # only show text
-        fill='toself',
-        name=region,
-        line=dict(color=colour, width=2),
-    ))
-    fig.add_trace(go.Scatterpolar(
-        r=[50]*len(r_values),  # Values for the radar plot
-        theta=theta_values,  # Categories (indicators)
-        fill='toself',  # Fill the area under the curve
-        name=f"UK median",
-        mode="lines",  # Only draw lines, no markers
-        line=dict(color="rgba(128, 128, 128, 0.5)", width=1),  # Grey line with transparency
-        fillcolor="rgba(128, 128, 128, 0.3)",  # Transparent grey fill
-        hoverinfo="skip"
-    ))
+    traces = [
+        {
+            'type': 'scatterpolar',
+            'r': r_values,
+            'theta': theta_values,
+            'text': hover_texts,         # supply custom hover text
+            'hoverinfo': "text",         # only show text
+            'fill': 'toself',
+            'name': region,
+            'line': {'color': colour, 'width': 2},
+        },
+        {
+            'type': 'scatterpolar',
+            'r': [50]*len(r_values),  # Values for the radar plot
+            'theta': theta_values,  # Categories (indicators)
+            'fill': 'toself',  # Fill the area under the curve
+            'name': "UK median",
+            'mode': "lines",  # Only draw lines, no markers
+            'line': {'color': "rgba(128, 128, 128, 0.5)", 'width': 1},  # Grey line with transparency
+            'fillcolor': "rgba(128, 128, 128, 0.3)",  # Transparent grey fill
+            'hoverinfo': "skip"
+        },
+    ]
 
-    # Update layout for better visualization
-    fig.update_layout(
-        polar=dict(
-            radialaxis=dict(
-                visible=True,
-                range=[0, 100],  # Adjust the range as needed
-                showticklabels=False,  # Remove radial axis ticks
-            ),
-            angularaxis=dict(
-                tickfont=dict(size=10),
-            ),
-            domain=dict(x=[0.2, 0.8]),  # shrink spider within figure
-        ),
-        title={
-            'text': '<span style="font-weight:normal;">' + 
-            '<br>'.join(textwrap.wrap(f"Spider Plot of <b>Productivity Indicators</b> {region} - <i>latest available data",width=55)) +
+    return _figure(traces, {
+        'polar': {
+            'radialaxis': {
+                'visible': True,
+                'range': [0, 100],  # Adjust the range as needed
+                'showticklabels': False,  # Remove radial axis ticks
+            },
+            'angularaxis': {
+                'tickfont': {'size': 10},
+            },
+            'domain': {'x': [0.2, 0.8]},  # shrink spider within figure
+        },
+        'title': {
+            'text': '<span style="font-weight:normal;">' +
+            _title(f"Spider Plot of <b>Productivity Indicators</b> {region} - <i>latest available data", 55) +
             '</span>',
             'font': {'size': 14},
         },
-        autosize=True,
-        template="plotly_white",  # Use a clean white background
-        showlegend=False,
-        margin=dict(l=10, r=10, t=66, b=80)
-    )
-    
-    return fig
+        'autosize': True,
+        'template': _template("plotly_white"),  # Use a clean white background
+        'showlegend': False,
+        'margin': {'l': 10, 'r': 10, 't': 66, 'b': 80}
+    })
 
-def bar(data, indicator, regions, driver):
-    temp = data.loc[(data['name'] == regions[0]), ['year', indicator]].dropna()
-    if indicator not in ['GVA per hour worked', 'GFCF per job', 'ICT per job', 'Intangibles per job']:
-        temp[indicator] = temp[indicator] * 100  # Multiply indicator values by 100
+@timing.timed('visualisations.bar')
+def bar(data, indicator, regions, driver, index=None):
+    if indicator not in MONEY_INDICATORS:
+        scale = 100  # Multiply indicator values by 100
         unit = '%'
     else:
+        scale = 1
         unit = '£'
-    # Create a bar chart
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        x=temp['year'],  # X-axis: Year
-        y=temp[indicator],  # Y-axis: Indicator values
-        name=f"{regions[0]}",
-        marker=dict(color="#eb5e5e")  # Customize bar color
-    ))
-    temp = data.loc[(data['name'] == regions[1]), ['year', indicator]].dropna()
-    if indicator not in ['GVA per hour worked', 'GFCF per job', 'ICT per job', 'Intangibles per job']:
-        temp[indicator] = temp[indicator] * 100  # Multiply indicator values by 100
-    fig.add_trace(go.Bar(
-        x=temp['year'],  # X-axis: Year
-        y=temp[indicator],  # Y-axis: Indicator values
-        name=f"{regions[1]}",
-        marker=dict(color="#9c4f8b")  # Customize bar color
-    ))
+    # Create a bar chart, one trace per region
+    traces = [
+        {
+            'type': 'bar',
+            'x': np.asarray(years),  # X-axis: Year
+            'y': np.asarray(values) * scale,  # Y-axis: Indicator values
+            'name': f"{region}",
+            'marker': {'color': colour}  # Customize bar color
+        }
+        for region, colour, (years, values) in zip(regions, REGION_COLOURS, _regions_series(data, regions, indicator, index))
+    ]
 
-    # Update layout for better visualization
-    fig.update_layout(
-        title={
-            'text': '<br>'.join(textwrap.wrap(f"Bar Chart for {regions[0]} against {regions[1]} - <b>{driver}</b>", width=80)),
+    return _figure(traces, {
+        'title': {
+            'text': _title(f"Bar Chart for {_regions_title(regions)} - <b>{driver}</b>", 80),
             'font': {'size': 14},
         },
-        xaxis_title="Year",
-        yaxis_title=f"{indicator} ({unit})",
-        autosize=True,
-        template="plotly_white",  # Use a clean white background
-        showlegend=False,
-        height=450,
-        margin=dict(l=100, r=40, t=100, b=100)
-    )
-    
-    return fig
\ No newline at end of file
+        'xaxis': {'title': {'text': "Year"}},
+        'yaxis': {'title': {'text': f"{indicator} ({unit})"}},
+        'autosize': True,
+        'template': _template("plotly_white"),  # Use a clean white background
+        'showlegend': False,
+        'height': 450,
+        'margin': {'l': 100, 'r': 40, 't': 100, 'b': 100}
+    })
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import data_prep
+import payloads
+import timing
+
+'''
+Background warm-up of the shared chart caches, so the first visitor to a page doesn't pay the cold cost.
+
+The app starts one Warmup per process and dataset version. It fills the caches with the payloads for the
+landing page and each configured popular pair first (both sides' gauges and spiders, the time series and
+every carousel slide), then the gauge and spider for every region on either side. Builds run on a
+background thread, or in a pool of worker processes so they don't hold the server's GIL. Nothing already
+cached is rebuilt, and each cache stops being warmed once it is full rather than evicting anything.
+
+Streamlit only runs the app once a session connects, so
+
+    python warmup.py --url http://localhost:80 [--wait 300]
+
+opens one to begin warming before anyone visits. serve.py runs it once for each worker as it comes up.
+'''
+
+logger = logging.getLogger('itl3_compare.warmup')
+
+# Which of the app's caches each payload goes into
+CACHES = {'gauge': 'figures', 'spider': 'figures', 'time_series': 'figures', 'bar_html': 'bars'}
+
+# Progress is logged each time this fraction of the tasks completes
+LOG_EVERY = 0.1
+
+def parse_pairs(text):
+    # 'TLC31:TLC32,TLM83:TLM84' -> [('TLC31', 'TLC32'), ('TLM83', 'TLM84')]. A malformed item is logged
+    # and skipped, so one typo in the setting never stops the rest being used
+    pairs = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        codes = [code.strip().upper() for code in item.split(':')]
+        if len(codes) != 2 or not all(codes):
+            timing.log_event(logger, 'warmup', state='bad_pair', item=item.strip(), expected='CODE:CODE')
+            continue
+        pairs.append(tuple(codes))
+    return pairs
+
+def tasks(dataset, pairs, indicator):
+    # Popular pages first, then every single-region payload
+    names = dict(zip(dataset['codes'], dataset['names']))
+    pages = [(dataset['names'][0], dataset['names'][1])]
+    for first, second in pairs:
+        if first in names and second in names and (names[first], names[second]) not in pages:
+            pages.append((names[first], names[second]))
+
+    ordered = []
+    for first, second in pages:
+        ordered.append(('gauge', first, indicator))
+        ordered.append(('spider', first, payloads.COLOURS[0]))
+        ordered.append(('gauge', second, indicator))
+        ordered.append(('spider', second, payloads.COLOURS[1]))
+        ordered.append(('time_series', first, second))
+        ordered.extend(('bar_html', bar, first, second) for bar in data_prep.DRIVER if bar != indicator)
+    ordered.extend(('gauge', region, indicator) for region in dataset['names'])
+    for colour in payloads.COLOURS:
+        ordered.extend(('spider', region, colour) for region in dataset['names'])
+    # Keep the first occurrence of anything queued twice
+    return list(dict.fromkeys(ordered))
+
+_dataset = None
+
+def _init_worker(data_path, uk_data_path, version):
+    global _dataset
+    _dataset = data_prep.build_dataset(data_path, uk_data_path)
+    # The data changed on disk since the server loaded it; its payloads would be cached under the wrong version
+    if _dataset['version'] != version:
+        raise RuntimeError(f"Dataset version {_dataset['version']} doesn't match the server's {version}")
+
+def _build(task):
+    return payloads.build(_dataset, task)
+
+class Warmup:
+    def __init__(self, dataset, caches, pairs=(), indicator='GVA per hour worked', workers=0, stale=None,
+                 data_paths=(data_prep.DATA_PATH, data_prep.UK_DATA_PATH)):
+        # stale() returning True stops the warm-up, e.g. once a newer dataset has been loaded. Worker
+        # processes load their own copy of the dataset from data_paths
+        self.dataset = dataset
+        self.data_paths = data_paths
+        self.stale = stale
+        self.caches = caches
+        self.tasks = tasks(dataset, pairs, indicator)
+        self.workers = workers
+        self.state = 'pending'
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.full = set()
+        self.started = None
+        self.elapsed = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='itl3-warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def progress(self):
+        return {
+            'state': self.state,
+            'total': len(self.tasks),
+            'done': self.done,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'full': sorted(self.full),
+            'elapsed_s': round(self.elapsed if self.elapsed is not None else time.perf_counter() - self.started, 3) if self.started else None,
+            'caches': {name: cache.stats() for name, cache in self.caches.items()},
+        }
+
+    def _run(self):
+        self.state = 'running'
+        self.started = time.perf_counter()
+        timing.log_event(logger, 'warmup', version=self.dataset['version'], workers=self.workers, tasks=len(self.tasks))
+        pending = [task for task in self.tasks if payloads.key(self.dataset['version'], task) not in self.caches[CACHES[task[0]]]]
+        self.skipped += len(self.tasks) - len(pending)
+        try:
+            if self.workers:
+                self._run_pool(pending)
+            else:
+                for task in pending:
+                    if self._superseded():
+                        break
+                    if CACHES[task[0]] in self.full:
+                        self.skipped += 1
+                        continue
+                    self._store(task, lambda: payloads.build(self.dataset, task))
+            self.state = 'superseded' if self._superseded() else 'finished'
+        except Exception as e:
+            self.state = f'failed: {type(e).__name__}: {e}'
+        self.elapsed = time.perf_counter() - self.started
+        timing.log_event(logger, 'warmup', **self.progress())
+
+    def _run_pool(self, pending):
+        # Spawned rather than forked, as the server process is multithreaded
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(*self.data_paths, self.dataset['version'])) as pool:
+            futures = {pool.submit(_build, task): task for task in pending}
+            for future in as_completed(futures):
+                task = futures[future]
+                if self._superseded():
+                    for queued in futures:
+                        queued.cancel()
+                    break
+                if future.cancelled() or CACHES[task[0]] in self.full:
+                    self.skipped += 1
+                    continue
+                if isinstance(future.exception(), BrokenProcessPool):
+                    # Every other build would fail the same way
+                    raise future.exception()
+                self._store(task, future.result)
+                if CACHES[task[0]] in self.full:
+                    # Nothing more will fit, so drop the builds still queued for this cache
+                    for queued, queued_task in futures.items():
+                        if CACHES[queued_task[0]] == CACHES[task[0]]:
+                            queued.cancel()
+
+    def _superseded(self):
+        return self.stale is not None and self.stale()
+
+    def _store(self, task, result):
+        cache = self.caches[CACHES[task[0]]]
+        try:
+            value = result()
+        except Exception:
+            self.failed += 1
+            logger.exception('Warming %s failed', task)
+            return
+        # Stop warming a cache once it's full, rather than evicting what's already there
+        if cache.size + cache.sizeof(value) > cache.max_size:
+            self.full.add(CACHES[task[0]])
+            self.skipped += 1
+            return
+        cache.put(payloads.key(self.dataset['version'], task), value)
+        self.done += 1
+        step = max(1, int(len(self.tasks) * LOG_EVERY))
+        if self.done % step == 0:
+            timing.log_event(logger, 'warmup', state=self.state, done=self.done, total=len(self.tasks))
+
+def wait_until_up(url, timeout):
+    # Polls Streamlit's health endpoint until the server answers
+    import urllib.request
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url.rstrip('/') + '/_stcore/health', timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{url} was not up after {timeout:g}s')
+        time.sleep(1)
+
+def trigger(url, timeout=120):
+    # Opens one session so the app runs once and starts warming
+    from tornado.websocket import websocket_connect
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    async def run():
+        ws = await websocket_connect(url.rstrip('/').replace('http', 'ws', 1) + '/_stcore/stream')
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.page_script_hash = ''
+        await ws.write_message(message.SerializeToString(), binary=True)
+        try:
+            while True:
+                data = await asyncio.wait_for(ws.read_message(), timeout)
+                if data is None:
+                    raise ConnectionError('Websocket closed by the server')
+                msg = ForwardMsg()
+                msg.ParseFromString(data)
+                if msg.WhichOneof('type') == 'script_finished':
+                    return
+        finally:
+            ws.close()
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start warming a running server by opening one session')
+    parser.add_argument('--url', default=os.environ.get('ITL3_URL', 'http://localhost:80'))
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--wait', type=float, default=0, help='Seconds to wait for the server to come up first')
+    args = parser.parse_args()
+    if args.wait:
+        wait_until_up(args.url, args.wait)
+    trigger(args.url, args.timeout)